@@ -7,6 +7,8 @@ CREATE TABLE public.users
 	email text  NOT NULL,
 	hashed_password text,
 	is_active boolean NOT NULL,
+	is_admin boolean NOT NULL DEFAULT false,
+	data_version bigint NOT NULL DEFAULT 0,
 	CONSTRAINT pk_users_id PRIMARY KEY (id)
 )
 
@@ -88,6 +90,29 @@ ALTER TABLE IF EXISTS public.investments_in_out
     OWNER to pi;
 
 
+CREATE TABLE public.investments_months
+(
+	id serial NOT NULL,
+	investment_id integer REFERENCES investments_items(id) ON DELETE CASCADE NOT NULL,
+	month date NOT NULL,
+	sum_in bigint NOT NULL DEFAULT 0,
+	sum_out bigint NOT NULL DEFAULT 0,
+	sum_fact integer,
+	first_in_id integer,
+	first_out_id integer,
+	first_fact_id integer,
+	CONSTRAINT pk_investments_months_id PRIMARY KEY (id),
+	CONSTRAINT uq_investments_months_investment_id_month UNIQUE (investment_id, month)
+)
+
+WITH (
+    OIDS = FALSE
+);
+
+ALTER TABLE IF EXISTS public.investments_months
+    OWNER to pi;
+
+
 CREATE TABLE public.key_rate
 (
 	id serial NOT NULL,
@@ -103,3 +128,32 @@ WITH (
 ALTER TABLE IF EXISTS public.key_rate
     OWNER to pi;
 
+
+CREATE TABLE public.global_data_version
+(
+	id integer NOT NULL,
+	version bigint NOT NULL DEFAULT 0,
+	CONSTRAINT pk_global_data_version_id PRIMARY KEY (id)
+)
+
+WITH (
+    OIDS = FALSE
+);
+
+ALTER TABLE IF EXISTS public.global_data_version
+    OWNER to pi;
+
+INSERT INTO public.global_data_version (id, version) VALUES (1, 0);
+
+
+CREATE INDEX ix_investments_history_investment_id_date
+    ON public.investments_history (investment_id, date, id) INCLUDE (sum);
+
+CREATE INDEX ix_investments_in_out_investment_id_date
+    ON public.investments_in_out (investment_id, date, id);
+
+CREATE INDEX ix_investments_items_owner_id
+    ON public.investments_items (owner_id);
+
+CREATE INDEX ix_categories_owner_id
+    ON public.categories (owner_id);
@@ -1,10 +1,17 @@
 #!/usr/bin/python3
 
 import ast
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
 
 import aiounittest
 import requests_async as requests
 
+import crud
+import sql_trace
+from database import database
 from config import TEST_USER_USERNAME, TEST_USER_PASSWORD
 
 
@@ -130,6 +137,15 @@ class TestInvestmentHistory(aiounittest.AsyncTestCase):
         new_investment = [d for d in mydata["history"] if d['id'] == storage.test_investment_history_id][0]
         self.assertTrue(new_investment['sum'] == 2000)
 
+        # test read investment history page by date range
+        params = {"user_id": storage.user_id, "investment_id": storage.test_investment_item_id,
+                  "date_from": "2022-06-01T00:00:00Z", "date_to": "2022-06-30T00:00:00Z", "limit": 1}
+        response = await requests.get(f'{storage.socket}/users/investment_history/',
+                                      headers=headers, params=params)
+        mydata = response.json()
+        self.assertTrue([d['id'] for d in mydata["history"]] == [storage.test_investment_history_id])
+        self.assertTrue(mydata["next_cursor"] is None)
+
         # test delete investment history
         params = {"user_id": storage.user_id, "investment_history_id": storage.test_investment_history_id}
         response = await requests.delete(f'{storage.socket}/users/investment_history/',
@@ -145,6 +161,98 @@ class TestInvestmentHistory(aiounittest.AsyncTestCase):
         self.assertTrue(mydata['result'] == "investments deleted")
 
 
+class TestAwareDates(aiounittest.AsyncTestCase):
+    async def test_aware_dates(self) -> None:
+        # refresh token, get user id
+        await storage.get_token()
+
+        headers = {"Authorization": f"Bearer {storage.token}"}
+        params = {"user_id": storage.user_id}
+        json = {"description": "test_item", "category_id": None}
+        response = await requests.post(f'{storage.socket}/users/investment_items/',
+                                       headers=headers, params=params, json=json)
+        investment_id = response.json()['id']
+
+        # test single-row history and in/out inserts accept dates with time zone
+        json = {"date": "2022-06-30T23:30:00+03:00", "sum": 1000, "investment_id": investment_id}
+        response = await requests.post(f'{storage.socket}/users/investment_history/',
+                                       headers=headers, params=params, json=json)
+        self.assertTrue(response.status_code == 200)
+        json = {"date": "2022-06-01T05:43:50.587Z", "description": "test_inout", "sum": 1000,
+                "investment_id": investment_id}
+        response = await requests.post(f'{storage.socket}/users/investment_inout/',
+                                       headers=headers, params=params, json=json)
+        self.assertTrue(response.status_code == 200)
+
+        # test date is stored as the same instant
+        params = {"user_id": storage.user_id, "investment_id": investment_id}
+        response = await requests.get(f'{storage.socket}/users/investment_history/',
+                                      headers=headers, params=params)
+        date = datetime.fromisoformat(response.json()["history"][0]["date"])
+        self.assertTrue(date == datetime(2022, 6, 30, 20, 30, tzinfo=timezone.utc))
+
+        params = {"user_id": storage.user_id, "investment_id": investment_id}
+        response = await requests.delete(f'{storage.socket}/users/investment_items/',
+                                         headers=headers, params=params)
+        self.assertTrue(response.status_code == 200)
+
+
+class TestInvestmentHistoryBatch(aiounittest.AsyncTestCase):
+    async def test_investment_history_batch(self) -> None:
+        # refresh token, get user id
+        await storage.get_token()
+
+        # test create new investment
+        headers = {"Authorization": f"Bearer {storage.token}"}
+        params = {"user_id": storage.user_id}
+        json = {"description": "test_item", "category_id": None}
+        response = await requests.post(f'{storage.socket}/users/investment_items/',
+                                       headers=headers, params=params, json=json)
+        investment_id = response.json()['id']
+
+        # test create investment history batch, unknown investment reported by item
+        json = [{"date": f"2022-{month:02}-01T05:43:50.587Z", "sum": 1000 * month, "investment_id": investment_id}
+                for month in range(1, 13)] + [{"sum": 1, "investment_id": 0}]
+        response = await requests.post(f'{storage.socket}/users/investment_history/batch/',
+                                       headers=headers, params=params, json=json)
+        mydata = response.json()
+        self.assertTrue(mydata['processed'] == 12)
+        self.assertTrue(mydata['items'][12]['error'] == "Investment id not found")
+        history_ids = [item['id'] for item in mydata['items'][:12]]
+
+        # test update investment history batch
+        json = [{"id": history_id, "date": "2022-06-01T05:45:50.587Z", "sum": 2000, "investment_id": investment_id}
+                for history_id in history_ids]
+        response = await requests.put(f'{storage.socket}/users/investment_history/batch/',
+                                      headers=headers, params=params, json=json)
+        self.assertTrue(response.json()['processed'] == 12)
+
+        # test update batch with repeated id is rejected
+        response = await requests.put(f'{storage.socket}/users/investment_history/batch/',
+                                      headers=headers, params=params, json=json[:1] * 2)
+        self.assertTrue(response.status_code == 400)
+
+        # test read investment history
+        params = {"user_id": storage.user_id, "investment_id": investment_id}
+        response = await requests.get(f'{storage.socket}/users/investment_history/',
+                                      headers=headers, params=params)
+        self.assertTrue(all(item['sum'] == 2000 for item in response.json()["history"]))
+
+        # test delete investment history batch
+        params = {"user_id": storage.user_id}
+        json = [{"id": history_id} for history_id in history_ids]
+        response = await requests.delete(f'{storage.socket}/users/investment_history/batch/',
+                                         headers=headers, params=params, json=json)
+        self.assertTrue(response.json()['processed'] == 12)
+
+        # test delete investment
+        params = {"user_id": storage.user_id, "investment_id": investment_id}
+        response = await requests.delete(f'{storage.socket}/users/investment_items/',
+                                         headers=headers, params=params)
+        mydata = ast.literal_eval(response.content.decode("UTF-8"))
+        self.assertTrue(mydata['result'] == "investments deleted")
+
+
 class TestInvestmentInOut(aiounittest.AsyncTestCase):
     async def test_investment_inout(self) -> None:
         # refresh token, get user id
@@ -244,6 +352,12 @@ class TestCategories(aiounittest.AsyncTestCase):
         new_category = [d for d in mydata["categories"] if d['id'] == storage.test_category_id][0]
         self.assertTrue(new_category['category'] == "updated_category")
 
+        # test conditional read of not changed categories
+        etag = response.headers["etag"]
+        response = await requests.get(f'{storage.socket}/users/categories/',
+                                      headers={**headers, "If-None-Match": etag}, params=params)
+        self.assertTrue(response.status_code == 304)
+
         # test delete category
         params = {"user_id": storage.user_id, "category_id": storage.test_category_id}
         response = await requests.delete(f'{storage.socket}/users/categories/',
@@ -251,6 +365,12 @@ class TestCategories(aiounittest.AsyncTestCase):
         mydata = ast.literal_eval(response.content.decode("UTF-8"))
         self.assertTrue(mydata['result'] == "category deleted")
 
+        # test conditional read of changed categories
+        params = {"user_id": storage.user_id}
+        response = await requests.get(f'{storage.socket}/users/categories/',
+                                      headers={**headers, "If-None-Match": etag}, params=params)
+        self.assertTrue(response.status_code == 200 and response.headers["etag"] != etag)
+
 
 class TestKeyRates(aiounittest.AsyncTestCase):
     async def test_key_rates(self) -> None:
@@ -294,9 +414,118 @@ class TestKeyReportsJSON(aiounittest.AsyncTestCase):
         report = [d for d in mydata["investment_report"] if d['id'] == storage.test_investment_item_id][0]
         self.assertTrue(report["description"] == "test_report")
 
+        # test create columnar json report
+        params = {"user_id": storage.user_id, "version": 2}
+        response = await requests.get(f'{storage.socket}/users/reports/json/',
+                                      headers=headers, params=params)
+        mydata = response.json()
+        report = [d for d in mydata["investment_report"] if d['id'] == storage.test_investment_item_id][0]
+        self.assertTrue(report["description"] == "test_report")
+        self.assertTrue(len(report["sum_plan"]) == report["length"])
+
         # test delete investment
         params = {"user_id": storage.user_id, "investment_id": storage.test_investment_item_id}
         response = await requests.delete(f'{storage.socket}/users/investment_items/',
                                          headers=headers, params=params)
         mydata = ast.literal_eval(response.content.decode("UTF-8"))
         self.assertTrue(mydata['result'] == "investments deleted")
+
+
+class TestImport(aiounittest.AsyncTestCase):
+    async def test_import(self) -> None:
+        # refresh token, get user id
+        await storage.get_token()
+
+        # test user with categories, imported investment has no category
+        headers = {"Authorization": f"Bearer {storage.token}"}
+        params = {"user_id": storage.user_id}
+        response = await requests.post(f'{storage.socket}/users/categories/',
+                                       headers=headers, params=params, json={"category": "test_import"})
+        category_id = response.json()['id']
+
+        # test import of csv, second import of the same file skips all rows
+        asset = f"test_import_{random.randint(0, 10 ** 9)}"
+        content = f"Актив,Дата,Пополнение,Снятие,Сумма факт\n{asset},2022-05,1000,,1000\n{asset},2022-06,,500,700\n"
+        params = {"user_id": storage.user_id, "format": "csv"}
+        for history, skipped in ((2, 0), (0, 4)):
+            response = await requests.post(f'{storage.socket}/users/import/', headers=headers, params=params,
+                                           files={"file": ("import.csv", content.encode("utf-8"), "text/csv")})
+            mydata = response.json()
+            self.assertTrue(mydata['history'] == history and mydata['skipped'] == skipped)
+
+        # test reports with imported investment
+        params = {"user_id": storage.user_id}
+        response = await requests.get(f'{storage.socket}/users/reports/json/', headers=headers, params=params)
+        self.assertTrue(response.status_code == 200)
+        report = [d for d in response.json()["investment_report"] if d['description'] == asset][0]
+        self.assertTrue(report["sum_fact"]["2022-06"] == 700)
+        params = {"user_id": storage.user_id, "version": 2}
+        response = await requests.get(f'{storage.socket}/users/reports/json/', headers=headers, params=params)
+        self.assertTrue(response.status_code == 200)
+
+        params = {"user_id": storage.user_id, "investment_id": report['id']}
+        await requests.delete(f'{storage.socket}/users/investment_items/', headers=headers, params=params)
+        params = {"user_id": storage.user_id, "category_id": category_id}
+        await requests.delete(f'{storage.socket}/users/categories/', headers=headers, params=params)
+
+
+class TestReportQueryBudget(aiounittest.AsyncTestCase):
+    async def test_report_query_budget(self) -> None:
+        # refresh token, get user id
+        await storage.get_token()
+
+        # report is calculated by a fixed number of queries whatever the number of investments
+        sql_trace.observe_queries(database)
+        await database.connect()
+        try:
+            with sql_trace.trace() as queries:
+                await crud.calculate_investment_report(storage.user_id)
+        finally:
+            await database.disconnect()
+        # investments, categories, key rates version and key rates, months (python engine: history and in/out)
+        queries.assert_budget(max_queries=6, max_repeats=1)
+
+
+async def server_gauges() -> dict:
+    """Gauges of /metrics by name"""
+    response = await requests.get(f'{storage.socket}/metrics')
+    return {line.split()[0]: float(line.split()[1]) for line in response.content.decode("UTF-8").splitlines()
+            if line and not line.startswith('#') and '{' not in line}
+
+
+class TestLoginThrottling(aiounittest.AsyncTestCase):
+    async def test_login_throttling(self) -> None:
+        # refresh token before flood, get user id
+        await storage.get_token()
+
+        # test flood of bad logins is answered at once, not parked,
+        # flood comes through trusted proxy from TEST-NET-2 address to not throttle other tests and re-runs
+        suffix = random.randrange(1, 255)
+        headers = {'X-Forwarded-For': f'198.51.100.{suffix}'}
+        data = {'username': f'throttling_test_user_{time.time_ns()}', 'password': 'wrong_password'}
+        before = await server_gauges()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[requests.post(f'{storage.socket}/token', data=data, headers=headers)
+                                           for _ in range(200)])
+        elapsed = time.perf_counter() - start
+        after = await server_gauges()
+        status_codes = {response.status_code for response in responses}
+        self.assertTrue(status_codes <= {401, 429})
+        self.assertTrue(429 in status_codes)
+        self.assertTrue(all('Retry-After' in response.headers
+                            for response in responses if response.status_code == 429))
+        self.assertTrue(elapsed < 10)
+
+        # test no request is left open and memory stays flat after flood
+        self.assertTrue(after['http_requests_in_progress'] <= before['http_requests_in_progress'])
+        if 'process_resident_memory_bytes' in before:
+            self.assertTrue(after['process_resident_memory_bytes'] - before['process_resident_memory_bytes']
+                            < 16 * 1024 * 1024)
+
+        # test flood did not throttle other clients and authenticated calls
+        data = {'username': storage.username, 'password': storage.password}
+        response = await requests.post(f'{storage.socket}/token', data=data)
+        self.assertTrue(response.status_code == 200)
+        headers = {"Authorization": f"Bearer {storage.token}"}
+        response = await requests.get(f'{storage.socket}/user', headers=headers)
+        self.assertTrue(response.status_code == 200)
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+
+from database import database, engine, metadata
+from models import investments_items
+from config import REPORT_ENGINE
+
+import crud
+import fast_json
+import report_engine
+import schemas
+import sql_trace
+import synthetic_data
+from report_cache import report_cache
+
+DEFAULT_SIZES = "1x1,10x5,100x10,1000x30"
+
+
+async def measure(name: str, size: str, run, setup, repeats: int) -> dict:
+    """Wall time of repeats, peak traced memory and query count of one more run"""
+    times = []
+    for _ in range(repeats):
+        await setup()
+        start = time.perf_counter()
+        await run()
+        times.append(time.perf_counter() - start)
+
+    await setup()
+    tracemalloc.start()
+    try:
+        with sql_trace.trace() as queries:
+            await run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    result = {"function": name, "size": size, "repeats": repeats,
+              "wall": {"min": min(times), "median": statistics.median(times), "max": max(times)},
+              "peak_memory": peak, "queries": len(queries.statements)}
+    print(f'{size:>10} {name:<28} median {result["wall"]["median"] * 1000:10.2f} ms '
+          f'peak {peak / 1024 / 1024:8.2f} MB queries {result["queries"]}')
+    return result
+
+
+async def nothing() -> None:
+    pass
+
+
+async def db_benchmarks(size: str, investments: int, years: int, seed: int, repeats: int) -> list:
+    """Benchmarks of report and investment list of synthetic user of size"""
+    username = f"bench_{investments}x{years}_{seed}"
+    user = await crud.get_user(username=username)
+    if user is None:
+        user_id = await synthetic_data.create_user_dataset(
+            synthetic_data.generate_dataset(investments, years, seed), username)
+    else:
+        user_id = user.id
+
+    async def cold_report():
+        report_cache.discard(user_id)
+
+    async def warm_report():
+        await crud.get_investment_report_json(user_id)
+
+    list_investments = await database.fetch_all(investments_items.select()
+                                                .where(investments_items.c.owner_id == user_id))
+
+    async def xlsx():
+        (await crud.get_investment_report_xlsx(user_id)).close()
+
+    results = [
+        await measure("get_investment_report_json", size, lambda: crud.get_investment_report_json(user_id),
+                      cold_report, repeats),
+        await measure("add_investments_results", size,
+                      lambda: crud.add_investments_results(user_id, list_investments), cold_report, repeats),
+        await measure("get_investment_report_xlsx", size, xlsx, warm_report, repeats),
+        await measure("get_user_investment_items", size, lambda: crud.get_user_investment_items(user_id),
+                      nothing, repeats),
+    ]
+    report = await crud.get_investment_report_json(user_id)
+    return results + await serialization_benchmarks(size, lambda: report, repeats)
+
+
+async def serialization_benchmarks(size: str, get_report, repeats: int) -> list:
+    """Encoding of report json by fast path and by stdlib json as JSONResponse did, output must be the same"""
+    report = get_report()
+    stdlib = json.dumps(report.dict(), ensure_ascii=False, allow_nan=False, indent=None,
+                        separators=(",", ":")).encode("utf-8")
+    if fast_json.dumps(report) != stdlib:
+        raise AssertionError(f"fast json of report {size} differs from stdlib json")
+
+    async def fast():
+        fast_json.dumps(get_report())
+
+    async def stdlib_json():
+        json.dumps(get_report().dict(), ensure_ascii=False, allow_nan=False, indent=None,
+                   separators=(",", ":")).encode("utf-8")
+
+    return [
+        await measure("serialize_report_json", size, fast, nothing, repeats),
+        await measure("serialize_report_json_stdlib", size, stdlib_json, nothing, repeats),
+    ]
+
+
+async def offline_benchmarks(size: str, investments: int, years: int, seed: int, repeats: int) -> list:
+    """Benchmarks of report engine and xlsx writer on generated rows without DB"""
+    dataset = synthetic_data.generate_dataset(investments, years, seed)
+    assets_rows = [{"history": [], "in_out": []} for _ in dataset["investments"]]
+    for kind in ("history", "in_out"):
+        for row in dataset[kind]:
+            assets_rows[row["investment"]][kind].append(row)
+    key_rates = report_engine.KeyRateSeries(dataset["key_rates"])
+    report = {}
+
+    async def engine_report():
+        assets_months = []
+        for rows in assets_rows:
+            asset_months = report_engine.AssetMonths()
+            asset_months.add_in_out(rows["in_out"])
+            asset_months.add_history(rows["history"])
+            assets_months.append(asset_months)
+        timelines = report_engine.ReportTimelines(assets_months, key_rates)
+        report["json"] = schemas.InvestmentReport.construct()
+        for i, investment in enumerate(dataset["investments"]):
+            asset = crud.new_report_asset({**investment, "id": i + 1}, {})
+            timelines.fill_report_asset(asset, i)
+            report["json"].investment_report.append(asset)
+
+    async def xlsx():
+        await asyncio.to_thread(crud.write_investment_report_xlsx, report["json"], BytesIO())
+
+    return [
+        await measure("report_engine", size, engine_report, nothing, repeats),
+        await measure("write_investment_report_xlsx", size, xlsx, nothing, repeats),
+        *await serialization_benchmarks(size, lambda: report["json"], repeats),
+    ]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(sizes: str, seed: int, repeats: int, offline: bool, output: str | None) -> None:
+    commit = git_commit()
+    results = []
+    if not offline:
+        await database.connect()
+        sql_trace.observe_queries(database)
+    try:
+        for size in sizes.split(","):
+            investments, years = (int(value) for value in size.split("x"))
+            benchmarks = offline_benchmarks if offline else db_benchmarks
+            results += await benchmarks(size, investments, years, seed, repeats)
+    finally:
+        if not offline:
+            await database.disconnect()
+
+    output = output or os.path.join("benchmarks", f"{commit or 'results'}{'-offline' if offline else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump({"commit": commit, "date": datetime.now(timezone.utc).isoformat(), "engine": REPORT_ENGINE,
+                   "offline": offline, "seed": seed, "results": results}, file, indent=2)
+    print(f'results saved to {output}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark report, xlsx export and investment list "
+                                                 "on synthetic users (run against a scratch DB)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma separated INVESTMENTSxYEARS")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--offline", action="store_true", help="report engine and xlsx writer only, no DB")
+    parser.add_argument("--output", help="json file, benchmarks/<commit>.json by default")
+    args = parser.parse_args()
+    if not args.offline:
+        metadata.create_all(bind=engine)
+    asyncio.run(main(args.sizes, args.seed, args.repeats, args.offline, args.output))
@@ -0,0 +1,199 @@
+import gzip
+import mimetypes
+import os
+import stat
+import zlib
+
+import brotli
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+import metrics
+from config import COMPRESSION_MIN_SIZE, COMPRESSION_THREADPOOL_MIN_SIZE, COMPRESSION_GZIP_LEVEL, \
+    COMPRESSION_BROTLI_QUALITY
+
+# encodings in order of preference for equal q values
+ENCODINGS = ("br", "gzip")
+# suffixes of prebuilt static files by encoding
+STATIC_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "image/svg+xml",
+                      "application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.file"}
+
+DEFAULT_LEVELS = {"br": COMPRESSION_BROTLI_QUALITY, "gzip": COMPRESSION_GZIP_LEVEL}
+# levels by route template, None disables compression of route
+ROUTE_LEVELS = {
+    # large and repetitive, worth more CPU
+    "/api/users/reports/json/": {"br": 5, "gzip": 6},
+    "/api/users/reports/table/": {"br": 5, "gzip": 6},
+    # scraped often, cheap is enough
+    "/metrics": {"br": 1, "gzip": 1},
+}
+
+
+def accepted_encodings(headers: Headers) -> list:
+    """Supported encodings allowed by Accept-Encoding, best first"""
+    quality = {}
+    for item in headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            quality[name] = q
+    result = []
+    for encoding in ENCODINGS:
+        q = quality.get(encoding, quality.get("*", 0.0))
+        if q > 0:
+            result.append((-q, ENCODINGS.index(encoding), encoding))
+    return [encoding for _, _, encoding in sorted(result)]
+
+
+def vary_by_encoding(headers: MutableHeaders) -> None:
+    vary = [item.strip().lower() for item in headers.get("vary", "").split(",")]
+    if "accept-encoding" not in vary:
+        headers.add_vary_header("Accept-Encoding")
+
+
+def compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith("+json") or media_type in COMPRESSIBLE_TYPES
+
+
+def compress(encoding: str, level: int, body: bytes) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class StreamCompressor:
+    """Compressor of body sent in several messages"""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + (self._compressor.finish() if last else b"")
+        return self._compressor.compress(data) + (self._compressor.flush() if last else b"")
+
+
+async def run_compression(size: int, func, *args) -> bytes:
+    """Compress small bodies in place, large ones in worker thread to keep event loop free"""
+    if size >= COMPRESSION_THREADPOOL_MIN_SIZE:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses by brotli or gzip negotiated by Accept-Encoding
+
+    Bodies below minimum_size, already encoded and not compressible responses are sent as is.
+    Strong ETag of compressed response is made weak, compressed bytes differ from identity ones.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encodings = accepted_encodings(Headers(scope=scope))
+
+        start = None
+        stream = None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                levels = self.levels(scope, start["status"], headers)
+                # compressible response varies by Accept-Encoding even when sent as is
+                if levels is not None:
+                    vary_by_encoding(headers)
+                if levels is None or not encodings or (not more_body and len(body) < self.minimum_size):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+
+                encoding = encodings[0]
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+                if not more_body:
+                    body = await run_compression(len(body), compress, encoding, levels[encoding], body)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                stream = StreamCompressor(encoding, levels[encoding])
+                await send(start)
+                start = None
+
+            if stream is None:
+                await send(message)
+                return
+            body = await run_compression(len(body), stream.compress, body, not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def levels(scope, status: int, headers: MutableHeaders) -> dict | None:
+        """Levels of route by encoding or None if response is not to be compressed"""
+        if status < 200 or status in (204, 304) or "content-encoding" in headers \
+                or not compressible(headers.get("content-type", "")):
+            return None
+        return ROUTE_LEVELS.get(metrics.route_template(scope), DEFAULT_LEVELS)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles serving prebuilt file.br or file.gz next to file if client accepts its encoding"""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        for encoding in accepted_encodings(request_headers):
+            compressed_path = f"{full_path}{STATIC_SUFFIXES[encoding]}"
+            try:
+                compressed_stat = os.stat(compressed_path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            # sibling older than file is left from previous build
+            if not stat.S_ISREG(compressed_stat.st_mode) or compressed_stat.st_mtime < stat_result.st_mtime:
+                continue
+            media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+            response = FileResponse(compressed_path, status_code=status_code, stat_result=compressed_stat,
+                                    method=scope["method"], media_type=media_type,
+                                    headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        vary_by_encoding(response.headers)
+        return response
@@ -1,4 +1,5 @@
 from starlette.config import Config
+from starlette.datastructures import CommaSeparatedStrings
 import schemas
 
 config = Config(schemas.Settings.Config.env_file)
@@ -16,6 +17,32 @@ ACCESS_TOKEN_EXPIRE_MINUTES = config('ACCESS_TOKEN_EXPIRE_MINUTES', cast=int)
 SECRET_KEY = config('SECRET_KEY')
 TEST_USER_USERNAME = config('TEST_USER_USERNAME')
 TEST_USER_PASSWORD = config('TEST_USER_PASSWORD')
+REPORT_ENGINE = config('REPORT_ENGINE', default='numpy')
+REPORT_CACHE_MAX_ENTRIES = config('REPORT_CACHE_MAX_ENTRIES', cast=int, default=256)
+REPORT_CACHE_MAX_BYTES = config('REPORT_CACHE_MAX_BYTES', cast=int, default=64 * 1024 * 1024)
+AUTH_CACHE_TTL = config('AUTH_CACHE_TTL', cast=float, default=30)
+AUTH_CACHE_MAX_ENTRIES = config('AUTH_CACHE_MAX_ENTRIES', cast=int, default=1024)
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', cast=int, default=4)
+PASSWORD_HASH_QUEUE = config('PASSWORD_HASH_QUEUE', cast=int, default=32)
+FAILURE_LIMIT_BURST = config('FAILURE_LIMIT_BURST', cast=int, default=5)
+FAILURE_LIMIT_MAX_KEYS = config('FAILURE_LIMIT_MAX_KEYS', cast=int, default=100000)
+TRUSTED_PROXIES = config('TRUSTED_PROXIES', cast=CommaSeparatedStrings, default='127.0.0.1')
+XLSX_SPOOL_MAX_SIZE = config('XLSX_SPOOL_MAX_SIZE', cast=int, default=8 * 1024 * 1024)
+BATCH_MAX_ITEMS = config('BATCH_MAX_ITEMS', cast=int, default=10000)
+DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', cast=int, default=10)
+DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', cast=int, default=10)
+DB_POOL_ACQUIRE_TIMEOUT = config('DB_POOL_ACQUIRE_TIMEOUT', cast=float, default=10)
+DB_STATEMENT_CACHE_SIZE = config('DB_STATEMENT_CACHE_SIZE', cast=int, default=100)
+DB_CONNECTION_MAX_LIFETIME = config('DB_CONNECTION_MAX_LIFETIME', cast=float, default=300)
+DB_CONNECTION_MAX_QUERIES = config('DB_CONNECTION_MAX_QUERIES', cast=int, default=50000)
+DB_POOL_READY_MAX_WAITERS = config('DB_POOL_READY_MAX_WAITERS', cast=int, default=DB_POOL_MAX_SIZE)
+SQL_TRACE = config('SQL_TRACE', cast=bool, default=False)
+SQL_TRACE_REPEAT_THRESHOLD = config('SQL_TRACE_REPEAT_THRESHOLD', cast=int, default=5)
+SQL_TRACE_SLOW_REQUEST = config('SQL_TRACE_SLOW_REQUEST', cast=float, default=1)
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', cast=int, default=1024)
+COMPRESSION_THREADPOOL_MIN_SIZE = config('COMPRESSION_THREADPOOL_MIN_SIZE', cast=int, default=64 * 1024)
+COMPRESSION_GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', cast=int, default=6)
+COMPRESSION_BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', cast=int, default=4)
 
 SQLALCHEMY_DATABASE_URL = \
     f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{DATABASE_NAME}"
@@ -1,16 +1,29 @@
 import models
 
-import os
-from datetime import datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from typing import List
+from tempfile import SpooledTemporaryFile
 from database import database
-from sqlalchemy import and_
-from models import users, investments_items, investments_history, investments_in_out, categories, key_rate
+from sqlalchemy import DateTime, and_, cast, func, literal, not_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from models import users, investments_items, investments_history, investments_in_out, investments_months, \
+    categories, key_rate, global_data_version
 import schemas
+import report_engine
+import report_import
+import metrics
+from report_cache import report_cache
+from principal_cache import principal_cache
+from config import REPORT_ENGINE, XLSX_SPOOL_MAX_SIZE
 
 from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
-from exeptions import CategoryInUse, CategoryNotFound, InvestmentNotFound, KeyRateNotFound
+from exeptions import CategoryInUse, CategoryNotFound, InvestmentNotFound, KeyRateNotFound, WrongCursor, \
+    ImportAlreadyRunning
 
 
 async def get_user(user_id: int | None = None,
@@ -27,6 +40,34 @@ async def get_user(user_id: int | None = None,
     return result
 
 
+async def bump_user_version(user_id: int) -> None:
+    """Mark user data (investments, history, in/out, categories) as changed, call in transaction of change"""
+    await database.execute(users.update().where(users.c.id == user_id)
+                           .values(data_version=users.c.data_version + 1))
+
+
+async def bump_global_version() -> None:
+    """Mark data shared by all users (key rates, monthly aggregates) as changed, call in transaction of change"""
+    query = insert(global_data_version).values(id=1, version=1)
+    await database.execute(query.on_conflict_do_update(index_elements=["id"],
+                                                       set_={"version": global_data_version.c.version + 1}))
+
+
+async def data_version(user_id: int) -> tuple:
+    """Current version of data used in user report, shared by all processes through DB
+
+    Take version before reading data: changes made while reading give a newer version.
+    """
+    global_version = select(global_data_version.c.version).scalar_subquery().label("global_version")
+    row = await database.fetch_one(select(users.c.data_version, global_version).where(users.c.id == user_id))
+    return (row["data_version"], row["global_version"] or 0) if row else (0, 0)
+
+
+async def key_rates_version() -> int:
+    """Current version of data shared by all users"""
+    return await database.fetch_val(select(global_data_version.c.version)) or 0
+
+
 async def create_user(user: schemas.UserCreate, hashed_password: str) -> schemas.User:
     """Create new user with hashed password in DB"""
     db_user = users.insert().values(username=user.username,
@@ -34,26 +75,37 @@ async def create_user(user: schemas.UserCreate, hashed_password: str) -> schemas
                                     hashed_password=hashed_password,
                                     is_active=user.is_active)
     user_id = await database.execute(db_user)
+    principal_cache.invalidate(user_id=user_id, username=user.username)
     return schemas.User(**user.dict(), id=user_id)
 
 
 async def create_user_investment_item(investment: schemas.InvestmentCreate, user_id: int) -> schemas.InvestmentInDB:
     """Create new investment in DB"""
     query = investments_items.insert().values(**investment.dict(), owner_id=user_id)
-    investment_id = await database.execute(query)
+    async with database.transaction():
+        investment_id = await database.execute(query)
+        await bump_user_version(user_id)
     return schemas.InvestmentInDB(**investment.dict(), id=investment_id, owner_id=user_id)
 
 
 async def get_user_investment_items(user_id: int) -> schemas.InvestmentUser:
     """Get user investments by user_id from DB"""
-    query = "SELECT id, description, is_active, (SELECT category FROM categories WHERE id = category_id), owner_id, " \
-            "(SELECT sum from investments_history WHERE date = " \
-            "(SELECT max(date) FROM investments_history " \
-            "WHERE investment_id = investments_items.id) AND investment_id = investments_items.id) " \
-            "FROM investments_items WHERE owner_id = :user_id"
+    # latest valuation by backward scan of ix_investments_history_investment_id_date for every investment
+    query = "SELECT investments_items.id, investments_items.description, investments_items.is_active, " \
+            "categories.category, investments_items.owner_id, last_history.sum " \
+            "FROM investments_items " \
+            "LEFT JOIN categories ON categories.id = investments_items.category_id " \
+            "LEFT JOIN LATERAL (SELECT sum FROM investments_history " \
+            "WHERE investment_id = investments_items.id " \
+            "ORDER BY date DESC, id DESC LIMIT 1) AS last_history ON true " \
+            "WHERE investments_items.owner_id = :user_id " \
+            "ORDER BY investments_items.id"
 
     list_investments = await database.fetch_all(query=query, values={"user_id": user_id})
-    list_investments_with_results = await add_investments_results(user_id, list_investments)
+    if REPORT_ENGINE == 'python':
+        list_investments_with_results = await add_investments_results(user_id, list_investments)
+    else:
+        list_investments_with_results = await add_investments_summary(user_id, list_investments)
 
     # if history and in/out for new investment not exist
     for investment in list_investments_with_results:
@@ -67,34 +119,28 @@ async def get_user_investment_items(user_id: int) -> schemas.InvestmentUser:
 
 async def update_user_investment_item(investment: schemas.InvestmentInDB, user_id: int) -> schemas.Result:
     """Update user investment in DB (description, category_id)"""
-    investment_in_db = await database.fetch_one(investments_items.select()
-                                                .where(and_(investments_items.c.id == investment.id,
-                                                            investments_items.c.owner_id == user_id)))
-    if investment_in_db:
-        query = investments_items.update().where(and_(investments_items.c.id == investment.id,
-                                                      investments_items.c.owner_id == user_id))\
-            .values(description=investment.description, category_id=investment.category_id)
-        await database.execute(query)
-        return schemas.Result(**{"result": "investment updated"})
-    else:
-        raise InvestmentNotFound
+    query = investments_items.update().where(and_(investments_items.c.id == investment.id,
+                                                  investments_items.c.owner_id == user_id))\
+        .values(description=investment.description, category_id=investment.category_id)\
+        .returning(investments_items.c.id)
+    async with database.transaction():
+        if await database.fetch_val(query) is None:
+            raise InvestmentNotFound
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investment updated"})
 
 
 async def delete_user_investment_item(investment_id: int, user_id: int) -> schemas.Result:
     """Delete user investment by id from DB"""
-
-    investment_in_db = await database.fetch_one(investments_items.select()
-                                                .where(and_(investments_items.c.id == investment_id,
-                                                            investments_items.c.owner_id == user_id)))
-    if investment_in_db:
-        investment_status = dict(investment_in_db)
-        query = investments_items.update().where(and_(investments_items.c.id == investment_id,
-                                                      investments_items.c.owner_id == user_id)) \
-            .values(is_active=not investment_status['is_active'])
-        await database.execute(query)
-        return schemas.Result(**{"result": "investment deactivated"})
-    else:
-        raise InvestmentNotFound
+    query = investments_items.update().where(and_(investments_items.c.id == investment_id,
+                                                  investments_items.c.owner_id == user_id)) \
+        .values(is_active=not_(investments_items.c.is_active))\
+        .returning(investments_items.c.id)
+    async with database.transaction():
+        if await database.fetch_val(query) is None:
+            raise InvestmentNotFound
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investment deactivated"})
     '''
     # delete investment item or deactivate
     query = investments_items.select().where(and_(investments_items.c.id == investment_id,
@@ -113,7 +159,9 @@ async def delete_user_investment_item(investment_id: int, user_id: int) -> schem
 async def create_user_category(category: schemas.CategoryCreate, user_id: int) -> schemas.CategoryInDB:
     """Create new category for user in DB"""
     query = categories.insert().values(**category.dict(), owner_id=user_id)
-    category_id = await database.execute(query)
+    async with database.transaction():
+        category_id = await database.execute(query)
+        await bump_user_version(user_id)
     return schemas.CategoryInDB(**category.dict(), id=category_id, owner_id=user_id)
 
 
@@ -125,15 +173,13 @@ async def get_user_categories(user_id: int) -> schemas.CategoryUser:
 
 async def update_user_category(category: schemas.CategoryOut, user_id: int) -> schemas.Result:
     """Update category from DB"""
-    query = categories.select().where(and_(categories.c.id == category.id,
-                                           categories.c.owner_id == user_id))
-    categories_found = await database.fetch_all(query)
-    if categories_found:
-        query = categories.update().where((categories.c.id == category.id)).values(category=category.category)
-        await database.execute(query)
-        return schemas.Result(**{"result": "category updated"})
-    else:
-        raise CategoryNotFound
+    query = categories.update().where(and_(categories.c.id == category.id, categories.c.owner_id == user_id))\
+        .values(category=category.category).returning(categories.c.id)
+    async with database.transaction():
+        if await database.fetch_val(query) is None:
+            raise CategoryNotFound
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "category updated"})
 
 
 async def delete_user_category(category_id: int, user_id: int) -> schemas.Result:
@@ -148,7 +194,9 @@ async def delete_user_category(category_id: int, user_id: int) -> schemas.Result
         result = await database.execute(query)
         if result:
             query = categories.delete().where(and_(categories.c.id == category_id, categories.c.owner_id == user_id))
-            await database.execute(query)
+            async with database.transaction():
+                await database.execute(query)
+                await bump_user_version(user_id)
             result = schemas.Result(**{"result": "category deleted"})
         else:
             raise CategoryNotFound
@@ -161,96 +209,486 @@ async def user_investment_exist(investment_id: int, user_id: int) -> bool:
                                                                           investments_items.c.owner_id == user_id)))
 
 
-async def create_user_investment_history(investment: schemas.HistoryCreate, user_id: int) -> schemas.HistoryInDB:
-    """Create new investment history in DB"""
-    if await user_investment_exist(investment_id=investment.investment_id, user_id=user_id):
-        query = investments_history.insert().values(**investment.dict())
-        investment_id = await database.execute(query)
-        return schemas.HistoryInDB(**investment.dict(), id=investment_id)
-    else:
-        raise InvestmentNotFound
+async def refresh_investment_month(investment_id: int, date: datetime) -> None:
+    """Recalculate monthly aggregate of investment for month of date from history and in/out"""
+    await refresh_investments_months({(investment_id, month_of(date))})
+
+
+def investments_months_query(where: str = "") -> str:
+    """Query upserting monthly aggregates from history and in/out, where limits rows of both
+
+    first_*_id are the smallest ids of rows of month, reports keep months in order of first rows like before.
+    """
+    return "INSERT INTO investments_months " \
+           "(investment_id, month, sum_in, sum_out, sum_fact, first_in_id, first_out_id, first_fact_id) " \
+           "SELECT investment_id, month, sum(sum_in), sum(sum_out), max(sum_fact), " \
+           "min(first_in_id), min(first_out_id), min(first_fact_id) FROM (" \
+           "SELECT investment_id, date_trunc('month', date)::date AS month, " \
+           "sum(CASE WHEN sum > 0 THEN sum ELSE 0 END) AS sum_in, " \
+           "sum(CASE WHEN sum < 0 THEN sum ELSE 0 END) AS sum_out, NULL::integer AS sum_fact, " \
+           "min(id) FILTER (WHERE sum > 0) AS first_in_id, min(id) FILTER (WHERE sum < 0) AS first_out_id, " \
+           "NULL::integer AS first_fact_id " \
+           f"FROM investments_in_out {where} GROUP BY 1, 2 " \
+           "UNION ALL " \
+           "SELECT investment_id, date_trunc('month', date)::date, 0, 0, (array_agg(sum ORDER BY id DESC))[1], " \
+           "NULL, NULL, min(id) " \
+           f"FROM investments_history {where} GROUP BY 1, 2" \
+           ") AS months GROUP BY investment_id, month " \
+           "HAVING sum(sum_in) <> 0 OR sum(sum_out) <> 0 OR max(sum_fact) IS NOT NULL " \
+           "ON CONFLICT (investment_id, month) DO UPDATE SET sum_in = excluded.sum_in, " \
+           "sum_out = excluded.sum_out, sum_fact = excluded.sum_fact, first_in_id = excluded.first_in_id, " \
+           "first_out_id = excluded.first_out_id, first_fact_id = excluded.first_fact_id"
+
+
+async def lock_investments(investment_ids: set) -> None:
+    """Lock investments in order of ids till end of transaction
+
+    Refreshes of months of one investment queue here, so every next statement sees rows committed by
+    the previous refresh. NO KEY UPDATE does not wait for foreign key checks of history and in/out inserts.
+    """
+    await database.execute(query="SELECT id FROM investments_items WHERE id = ANY(CAST(:investment_ids AS integer[])) "
+                                 "ORDER BY id FOR NO KEY UPDATE",
+                           values={"investment_ids": sorted(investment_ids)})
+
+
+async def refresh_investments_months(investment_months: set) -> None:
+    """Recalculate monthly aggregates for set of (investment_id, month start) in transaction"""
+    if not investment_months:
+        return
+    await lock_investments({investment_id for investment_id, _ in investment_months})
+    params = {"investment_ids": [investment_id for investment_id, _ in investment_months],
+              "months": [month for _, month in investment_months]}
+    months = "(SELECT * FROM unnest(CAST(:investment_ids AS integer[]), CAST(:months AS date[])))"
+    # months of reports are taken in UTC
+    await database.execute("SET LOCAL TIME ZONE 'UTC'")
+    await database.execute(query=f"DELETE FROM investments_months WHERE (investment_id, month) IN {months}",
+                           values=params)
+    await database.execute(query=investments_months_query(
+        f"WHERE (investment_id, date_trunc('month', date)::date) IN {months}"), values=params)
+
+
+def month_of(date: datetime):
+    """First day of month of date as in investments_months"""
+    return report_engine.month_bounds(date)[0].date()
+
+
+async def rebuild_investments_months() -> int:
+    """Rebuild monthly aggregates of all investments from history and in/out"""
+    async with database.transaction():
+        # writers of months wait for rebuild and then recalculate their months
+        await database.execute("LOCK TABLE investments_months IN EXCLUSIVE MODE")
+        # months of reports are taken in UTC
+        await database.execute("SET LOCAL TIME ZONE 'UTC'")
+        await database.execute(investments_months.delete())
+        await database.execute(investments_months_query())
+        months = await database.fetch_val(select(func.count()).select_from(investments_months))
+        await bump_global_version()
+    return months
+
+
+def user_investment_ids(user_id: int):
+    """Subquery of ids of user investments"""
+    return select(investments_items.c.id).where(investments_items.c.owner_id == user_id)
+
+
+def typed_literal(column, value):
+    """Bound value cast to type of column, dates as timestamptz since all writers pass UTC-aware datetimes"""
+    return cast(literal(value), DateTime(timezone=True) if isinstance(column.type, DateTime) else column.type)
+
+
+async def create_investment_row(table, item, user_id: int) -> int | None:
+    """Insert history or in/out row by one statement if investment belongs to user, id of row or None"""
+    values = item.dict()
+    investment_id = values.pop("investment_id")
+    query = table.insert().from_select(
+        list(values) + ["investment_id"],
+        select(*[typed_literal(table.c[name], value) for name, value in values.items()], investments_items.c.id)
+        .where(and_(investments_items.c.id == investment_id, investments_items.c.owner_id == user_id)))\
+        .returning(table.c.id)
+    return await database.fetch_val(query)
+
+
+async def update_investment_row(table, item, columns: list, user_id: int):
+    """Update history or in/out row by one statement if its investment belongs to user
+
+    Returns id, investment_id, new date and old date of row or None.
+    """
+    old = table.alias("old")
+    query = table.update()\
+        .where(and_(table.c.id == item.id, old.c.id == table.c.id,
+                    table.c.investment_id.in_(user_investment_ids(user_id))))\
+        .values({name: getattr(item, name) for name in columns})\
+        .returning(table.c.id, table.c.investment_id, table.c.date, old.c.date.label("old_date"))
+    return await database.fetch_one(query)
+
+
+async def delete_investment_row(table, row_id: int, user_id: int):
+    """Delete history or in/out row by one statement if its investment belongs to user, deleted row or None"""
+    query = table.delete()\
+        .where(and_(table.c.id == row_id, table.c.investment_id.in_(user_investment_ids(user_id))))\
+        .returning(table.c.id, table.c.investment_id, table.c.date)
+    return await database.fetch_one(query)
 
 
-async def get_user_investment_history(user_id: int, investment_id: int) -> schemas.HistoryUser:
-    """Get user investments history by user_id from DB"""
+async def create_user_investment_history(investment: schemas.HistoryCreate, user_id: int) -> schemas.HistoryInDB:
+    """Create new investment history in DB"""
+    async with database.transaction():
+        investment_id = await create_investment_row(investments_history, investment, user_id)
+        if investment_id is None:
+            raise InvestmentNotFound
+        await refresh_investment_month(investment.investment_id, investment.date)
+        await bump_user_version(user_id)
+    return schemas.HistoryInDB(**investment.dict(), id=investment_id)
+
+
+def encode_cursor(row) -> str:
+    """Opaque cursor of page after row"""
+    return urlsafe_b64encode(f'{row["date"].isoformat()} {row["id"]}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(date, id) of last row of previous page"""
+    try:
+        date, row_id = urlsafe_b64decode(cursor.encode()).decode().split(' ')
+        return datetime.fromisoformat(date), int(row_id)
+    except ValueError:
+        raise WrongCursor
+
+
+async def get_investment_rows_page(table, investment_id: int, date_from: datetime | None, date_to: datetime | None,
+                                   cursor: str | None, limit: int | None) -> tuple:
+    """Rows of investment ordered by (date, id) and cursor of next page, by index (investment_id, date, id)"""
+    query = table.select().where(table.c.investment_id == investment_id).order_by(table.c.date, table.c.id)
+    if date_from is not None:
+        query = query.where(table.c.date >= date_from)
+    if date_to is not None:
+        query = query.where(table.c.date <= date_to)
+    if cursor is not None:
+        query = query.where(tuple_(table.c.date, table.c.id) > tuple_(*decode_cursor(cursor)))
+    if limit is not None:
+        # one row more tells that next page exists
+        query = query.limit(limit + 1)
+    rows = await database.fetch_all(query)
+    if limit is not None and len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+
+async def get_user_investment_history(user_id: int, investment_id: int, date_from: datetime | None = None,
+                                      date_to: datetime | None = None, cursor: str | None = None,
+                                      limit: int | None = None) -> schemas.HistoryUser:
+    """Get page of user investment history ordered by date from DB"""
     if await user_investment_exist(investment_id=investment_id, user_id=user_id):
-        list_investment_history = await database.fetch_all(investments_history.select()
-                                                           .where(investments_history.c.investment_id == investment_id))
-        return schemas.HistoryUser(**{"history": [dict(result) for result in list_investment_history]})
+        rows, next_cursor = await get_investment_rows_page(investments_history, investment_id,
+                                                           date_from, date_to, cursor, limit)
+        # rows of DB match schema, model is built without validation
+        return schemas.HistoryUser.construct(history=[schemas.HistoryOut.construct(**row) for row in rows],
+                                             next_cursor=next_cursor)
     else:
         raise InvestmentNotFound
 
 
 async def update_user_investment_history(investment: schemas.HistoryOut, user_id: int) -> schemas.Result:
     """Update user investment history in DB (date, sum)"""
-    if await user_investment_exist(investment_id=investment.investment_id, user_id=user_id):
-        query = investments_history.update().where((investments_history.c.id == investment.id))\
-            .values(date=investment.date, sum=investment.sum)
-        await database.execute(query)
-        return schemas.Result(**{"result": "investment history updated"})
-    else:
-        raise InvestmentNotFound
+    async with database.transaction():
+        row = await update_investment_row(investments_history, investment, ["date", "sum"], user_id)
+        if row is None:
+            raise InvestmentNotFound
+        await refresh_investments_months({(row["investment_id"], month_of(row["old_date"])),
+                                          (row["investment_id"], month_of(row["date"]))})
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investment history updated"})
 
 
 async def delete_user_investment_history(investment_history_id: int, user_id: int) -> schemas.Result:
     """Delete user investment history by id from DB"""
-    investment_history_in_db = await database.fetch_one(investments_history
-                                             .select().where(investments_history.c.id == investment_history_id))
-    if investment_history_in_db and await user_investment_exist(investment_id=investment_history_in_db.investment_id,
-                                                                user_id=user_id):
-        query = investments_history.delete()\
-            .where(and_(investments_history.c.id == investment_history_id,
-                        investments_history.c.investment_id == investment_history_in_db.investment_id))
-        await database.execute(query)
-        return schemas.Result(**{"result": "investments history item deleted"})
-    else:
-        raise InvestmentNotFound
+    async with database.transaction():
+        row = await delete_investment_row(investments_history, investment_history_id, user_id)
+        if row is None:
+            raise InvestmentNotFound
+        await refresh_investment_month(row["investment_id"], row["date"])
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investments history item deleted"})
 
 
 async def create_user_investment_inout(investment: schemas.InOutCreate, user_id: int) -> schemas.InOutInDB:
     """Create new investment in/out in DB"""
-    if await user_investment_exist(investment_id=investment.investment_id, user_id=user_id):
-        query = investments_in_out.insert().values(**investment.dict())
-        investment_id = await database.execute(query)
-        return schemas.InOutInDB(**investment.dict(), id=investment_id)
-    else:
-        raise InvestmentNotFound
-
-
-async def get_user_investment_inout(user_id: int, investment_id: int) -> schemas.InOutUser:
-    """Get user investments in/out by user_id from DB"""
+    async with database.transaction():
+        investment_id = await create_investment_row(investments_in_out, investment, user_id)
+        if investment_id is None:
+            raise InvestmentNotFound
+        await refresh_investment_month(investment.investment_id, investment.date)
+        await bump_user_version(user_id)
+    return schemas.InOutInDB(**investment.dict(), id=investment_id)
+
+
+async def get_user_investment_inout(user_id: int, investment_id: int, date_from: datetime | None = None,
+                                    date_to: datetime | None = None, cursor: str | None = None,
+                                    limit: int | None = None) -> schemas.InOutUser:
+    """Get page of user investment in/out ordered by date from DB"""
     if await user_investment_exist(investment_id=investment_id, user_id=user_id):
-        list_investment_in_out = await database.fetch_all(investments_in_out.select()
-                                                           .where(investments_in_out.c.investment_id == investment_id))
-        return schemas.InOutUser(**{"in_out": [dict(result) for result in list_investment_in_out]})
+        rows, next_cursor = await get_investment_rows_page(investments_in_out, investment_id,
+                                                           date_from, date_to, cursor, limit)
+        # rows of DB match schema, model is built without validation
+        return schemas.InOutUser.construct(in_out=[schemas.InOutOut.construct(**row) for row in rows],
+                                           next_cursor=next_cursor)
     else:
         raise InvestmentNotFound
 
 
 async def update_user_investment_inout(investment: schemas.InOutOut, user_id: int) -> schemas.Result:
-    """Update user investment in/out in DB (date, sum)"""
-    if await user_investment_exist(investment_id=investment.investment_id, user_id=user_id):
-        query = investments_in_out.update().where((investments_in_out.c.id == investment.id))\
-            .values(date=investment.date, description=investment.description, sum=investment.sum)
-        await database.execute(query)
-        return schemas.Result(**{"result": "investment in/out updated"})
-    else:
-        raise InvestmentNotFound
+    """Update user investment in/out in DB (date, description, sum)"""
+    async with database.transaction():
+        row = await update_investment_row(investments_in_out, investment, ["date", "description", "sum"], user_id)
+        if row is None:
+            raise InvestmentNotFound
+        await refresh_investments_months({(row["investment_id"], month_of(row["old_date"])),
+                                          (row["investment_id"], month_of(row["date"]))})
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investment in/out updated"})
 
 
 async def delete_user_investment_inout(investment_in_out_id: int, user_id: int) -> schemas.Result:
     """Delete user investment in/out by id from DB"""
-    investment_in_out_in_db = await database.fetch_one(investments_in_out
-                                             .select().where(investments_in_out.c.id == investment_in_out_id))
-    if investment_in_out_in_db and await user_investment_exist(investment_id=investment_in_out_in_db.investment_id,
-                                                               user_id=user_id):
-        query = investments_in_out.delete()\
-            .where(and_(investments_in_out.c.id == investment_in_out_id,
-                        investments_in_out.c.investment_id == investment_in_out_in_db.investment_id))
-        await database.execute(query)
-        return schemas.Result(**{"result": "investments in/out item deleted"})
-    else:
-        raise InvestmentNotFound
+    async with database.transaction():
+        row = await delete_investment_row(investments_in_out, investment_in_out_id, user_id)
+        if row is None:
+            raise InvestmentNotFound
+        await refresh_investment_month(row["investment_id"], row["date"])
+        await bump_user_version(user_id)
+    return schemas.Result(**{"result": "investments in/out item deleted"})
+
+
+BATCH_CHUNK_ROWS = 1000
+
+
+async def get_user_investment_ids(investment_ids, user_id: int) -> set:
+    """Get ids of user investments among investment_ids by one query"""
+    query = user_investment_ids(user_id).where(investments_items.c.id.in_(set(investment_ids)))
+    return {row["id"] for row in await database.fetch_all(query)}
+
+
+def batch_result(results: list) -> schemas.BatchResult:
+    results.sort(key=lambda item: item.index)
+    return schemas.BatchResult(processed=sum(item.error is None for item in results), items=results)
+
+
+async def create_investment_rows_batch(table, items: list, user_id: int) -> schemas.BatchResult:
+    """Insert history or in/out rows of user investments by multi-row inserts in one transaction"""
+    owned = await get_user_investment_ids([item.investment_id for item in items], user_id) if items else set()
+    results = [schemas.BatchItemResult(index=index, error="Investment id not found")
+               for index, item in enumerate(items) if item.investment_id not in owned]
+    rows = [(index, item) for index, item in enumerate(items) if item.investment_id in owned]
+    if rows:
+        async with database.transaction():
+            for start in range(0, len(rows), BATCH_CHUNK_ROWS):
+                chunk = rows[start:start + BATCH_CHUNK_ROWS]
+                query = table.insert().values([item.dict() for _, item in chunk]).returning(table.c.id)
+                ids = await database.fetch_all(query)
+                results += [schemas.BatchItemResult(index=index, id=row["id"]) for (index, _), row in zip(chunk, ids)]
+            await refresh_investments_months({(item.investment_id, month_of(item.date)) for _, item in rows})
+            await bump_user_version(user_id)
+    return batch_result(results)
+
+
+async def update_investment_rows_batch(table, items: list, columns: list, user_id: int,
+                                       error: str) -> schemas.BatchResult:
+    """Update history or in/out rows of user investments in one transaction"""
+    updated = {}
+    async with database.transaction():
+        # same statement for every row, so it is prepared once
+        for item in items:
+            row = await update_investment_row(table, item, columns, user_id)
+            if row:
+                updated.setdefault(row["id"], []).append(row)
+        await refresh_investments_months({(row["investment_id"], month_of(date)) for rows in updated.values()
+                                          for row in rows for date in (row["date"], row["old_date"])})
+        if updated:
+            await bump_user_version(user_id)
+    return batch_result([schemas.BatchItemResult(index=index, id=item.id)
+                         if item.id in updated else schemas.BatchItemResult(index=index, error=error)
+                         for index, item in enumerate(items)])
+
+
+async def delete_investment_rows_batch(table, ids: list, user_id: int, error: str) -> schemas.BatchResult:
+    """Delete history or in/out rows of user investments by one statement per chunk in one transaction"""
+    deleted = {}
+    async with database.transaction():
+        for start in range(0, len(ids), BATCH_CHUNK_ROWS):
+            query = table.delete()\
+                .where(and_(table.c.id.in_(set(ids[start:start + BATCH_CHUNK_ROWS])),
+                            table.c.investment_id.in_(user_investment_ids(user_id))))\
+                .returning(table.c.id, table.c.investment_id, table.c.date)
+            for row in await database.fetch_all(query):
+                deleted[row["id"]] = row
+        await refresh_investments_months({(row["investment_id"], month_of(row["date"]))
+                                          for row in deleted.values()})
+        if deleted:
+            await bump_user_version(user_id)
+    # repeated id is deleted once
+    results, seen = [], set()
+    for index, item_id in enumerate(ids):
+        if item_id in deleted and item_id not in seen:
+            results.append(schemas.BatchItemResult(index=index, id=item_id))
+        else:
+            results.append(schemas.BatchItemResult(index=index, error=error))
+        seen.add(item_id)
+    return batch_result(results)
+
+
+async def create_user_investment_history_batch(items: List[schemas.HistoryCreate],
+                                               user_id: int) -> schemas.BatchResult:
+    """Create investment history items in DB"""
+    return await create_investment_rows_batch(investments_history, items, user_id)
+
+
+async def update_user_investment_history_batch(items: List[schemas.HistoryOut], user_id: int) -> schemas.BatchResult:
+    """Update investment history items in DB (date, sum)"""
+    return await update_investment_rows_batch(investments_history, items, ["date", "sum"], user_id,
+                                              "Investment history for update not found")
+
+
+async def delete_user_investment_history_batch(ids: List[int], user_id: int) -> schemas.BatchResult:
+    """Delete investment history items by ids from DB"""
+    return await delete_investment_rows_batch(investments_history, ids, user_id,
+                                              "Investment history for delete not found")
+
+
+async def create_user_investment_inout_batch(items: List[schemas.InOutCreate], user_id: int) -> schemas.BatchResult:
+    """Create investment in/out items in DB"""
+    return await create_investment_rows_batch(investments_in_out, items, user_id)
+
+
+async def update_user_investment_inout_batch(items: List[schemas.InOutOut], user_id: int) -> schemas.BatchResult:
+    """Update investment in/out items in DB (date, description, sum)"""
+    return await update_investment_rows_batch(investments_in_out, items, ["date", "description", "sum"], user_id,
+                                              "Investment in/out for update not found")
+
+
+async def delete_user_investment_inout_batch(ids: List[int], user_id: int) -> schemas.BatchResult:
+    """Delete investment in/out items by ids from DB"""
+    return await delete_investment_rows_batch(investments_in_out, ids, user_id,
+                                              "Investment in/out for delete not found")
+
+
+# progress of running imports by user id, kept in memory of worker running import,
+# so progress is answered only by that worker (one worker process serves all progress requests)
+import_progress = {}
+
+# key of advisory lock of user import, second key is user id, guards imports across worker processes
+IMPORT_LOCK_KEY = 20220602
+
+
+async def insert_rows(table, rows: list) -> None:
+    """Insert rows by multi-row inserts of BATCH_CHUNK_ROWS rows"""
+    for start in range(0, len(rows), BATCH_CHUNK_ROWS):
+        await database.execute(table.insert().values(rows[start:start + BATCH_CHUNK_ROWS]))
+
+
+def row_key(investment_id: int, date: datetime, value: int) -> tuple:
+    """Key of history or in/out row to find rows imported before, dates compared in UTC"""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return investment_id, date, value
+
+
+async def get_chunk_row_keys(table, investment_ids: set, dates: list) -> set:
+    """Keys of history or in/out rows in DB of chunk investments between first and last date of chunk"""
+    query = select(table.c.investment_id, table.c.date, table.c.sum)\
+        .where(and_(table.c.investment_id.in_(investment_ids), table.c.date >= min(dates), table.c.date <= max(dates)))
+    return {row_key(row["investment_id"], row["date"], row["sum"]) for row in await database.fetch_all(query)}
+
+
+def is_new_row(keys: set, key: tuple) -> bool:
+    """True for row not seen in DB or in file before, row is remembered"""
+    if key in keys:
+        return False
+    keys.add(key)
+    return True
+
+
+async def import_user_investments(file, file_format: str, user_id: int) -> schemas.ImportResult:
+    """Import history and in/out from xlsx report or csv in one transaction, missing investments are created
+
+    File is parsed in worker thread chunk by chunk, investments are matched with sheets (csv Актив) by description.
+    Rows already in DB (same investment, date and sum) are skipped, so import of the same file again adds nothing.
+    Rows in DB are looked up chunk by chunk, so memory does not grow with history of user.
+    """
+    result = schemas.ImportResult()
+    # registered before first await, so second import of user is seen by caller
+    import_progress[user_id] = result
+    try:
+        months = set()
+        async with database.transaction():
+            if not await database.fetch_val("SELECT pg_try_advisory_xact_lock(:key, :user_id)",
+                                            values={"key": IMPORT_LOCK_KEY, "user_id": user_id}):
+                raise ImportAlreadyRunning
+            investment_ids = {}
+            for row in await database.fetch_all(select(investments_items.c.id, investments_items.c.description)
+                                                .where(investments_items.c.owner_id == user_id)
+                                                .order_by(investments_items.c.id)):
+                investment_ids.setdefault(row["description"], row["id"])
+            async for chunk in iterate_in_threadpool(report_import.iterate_chunks(file, file_format)):
+                new_assets = sorted({asset for asset, *_ in chunk} - investment_ids.keys())
+                if new_assets:
+                    query = investments_items.insert()\
+                        .values([{"description": asset, "category_id": None, "owner_id": user_id, "is_active": True}
+                                 for asset in new_assets])\
+                        .returning(investments_items.c.id, investments_items.c.description)
+                    for row in await database.fetch_all(query):
+                        investment_ids[row["description"]] = row["id"]
+                    result.investments += len(new_assets)
+
+                # rows of previous chunks are inserted already, so they are found in DB too
+                chunk_ids = {investment_ids[asset] for asset, *_ in chunk}
+                chunk_dates = [date for _, date, *_ in chunk]
+                history_keys = await get_chunk_row_keys(investments_history, chunk_ids, chunk_dates)
+                in_out_keys = await get_chunk_row_keys(investments_in_out, chunk_ids, chunk_dates)
+                history, in_out = [], []
+                for asset, date, sum_in, sum_out, sum_fact in chunk:
+                    investment_id = investment_ids[asset]
+                    if sum_fact is not None:
+                        if is_new_row(history_keys, row_key(investment_id, date, sum_fact)):
+                            history.append({"date": date, "sum": sum_fact, "investment_id": investment_id})
+                        else:
+                            result.skipped += 1
+                    for value, description in ((sum_in, "Пополнение"), (sum_out, "Снятие")):
+                        if not value:
+                            continue
+                        if is_new_row(in_out_keys, row_key(investment_id, date, value)):
+                            in_out.append({"date": date, "description": description, "sum": value,
+                                           "investment_id": investment_id})
+                        else:
+                            result.skipped += 1
+                    months.add((investment_id, month_of(date)))
+                await insert_rows(investments_history, history)
+                await insert_rows(investments_in_out, in_out)
+                result.rows += len(chunk)
+                result.history += len(history)
+                result.in_out += len(in_out)
+            await refresh_investments_months(months)
+            await bump_user_version(user_id)
+    finally:
+        import_progress.pop(user_id, None)
+    result.done = True
+    return result
+
+
+# (global version taken before loading, series)
+key_rate_series: tuple | None = None
+
+
+async def get_key_rate_series() -> report_engine.KeyRateSeries:
+    """Get key rates by month shared by all reports, load from DB after key rate change in any process"""
+    global key_rate_series
+    version = await key_rates_version()
+    cached = key_rate_series
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    series = report_engine.KeyRateSeries(await database.fetch_all(key_rate.select()))
+    # series loaded while key rates changed is kept with older version and loaded again next time
+    key_rate_series = (version, series)
+    return series
 
 
 async def get_key_rate() -> schemas.KeyRateUser:
@@ -265,234 +703,332 @@ async def get_key_rate() -> schemas.KeyRateUser:
 async def create_user_key_rate(keyrate: schemas.KeyRateCreate) -> schemas.KeyRateInDB:
     """Create new key rate in DB"""
     query = key_rate.insert().values(**keyrate.dict())
-    key_rate_id = await database.execute(query)
+    async with database.transaction():
+        key_rate_id = await database.execute(query)
+        # shared key rates will be loaded again by next report of every process
+        await bump_global_version()
     return schemas.KeyRateInDB(**keyrate.dict(), id=key_rate_id)
 
 
-async def get_investment_report_json(user_id: int) -> schemas.InvestmentReport:
-    """Create investment report in json"""
-    user_report = schemas.InvestmentReport()
+def group_by_investment(rows) -> dict:
+    """Group DB rows by investment_id keeping original order"""
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['investment_id'], []).append(row)
+    return grouped
+
+
+async def get_user_investments_inout_grouped(user_id: int) -> dict:
+    """Get in/out for all user investments by one query, grouped by investment_id"""
+    query = investments_in_out.select()\
+        .select_from(investments_in_out.join(investments_items,
+                                             investments_in_out.c.investment_id == investments_items.c.id))\
+        .where(investments_items.c.owner_id == user_id)\
+        .order_by(investments_in_out.c.id)
+    return group_by_investment(await database.fetch_all(query))
+
+
+async def get_user_investments_history_grouped(user_id: int) -> dict:
+    """Get history for all user investments by one query, grouped by investment_id"""
+    query = investments_history.select()\
+        .select_from(investments_history.join(investments_items,
+                                              investments_history.c.investment_id == investments_items.c.id))\
+        .where(investments_items.c.owner_id == user_id)\
+        .order_by(investments_history.c.id)
+    return group_by_investment(await database.fetch_all(query))
+
+
+async def get_user_investments_months(user_id: int) -> list:
+    """Get monthly aggregates for all user investments by one query, ordered by investment_id and month"""
+    query = investments_months.select()\
+        .select_from(investments_months.join(investments_items,
+                                             investments_months.c.investment_id == investments_items.c.id))\
+        .where(investments_items.c.owner_id == user_id)\
+        .order_by(investments_months.c.investment_id, investments_months.c.month)
+    return await database.fetch_all(query)
+
+
+async def get_user_investments_months_grouped(user_id: int) -> dict:
+    """Get monthly aggregates for all user investments, grouped by investment_id"""
+    return group_by_investment(await get_user_investments_months(user_id))
+
+
+def build_report_timelines(user_months: dict, list_investments,
+                           key_rates: report_engine.KeyRateSeries) -> report_engine.ReportTimelines:
+    """Calculate report series of user investments from monthly aggregates grouped by investment"""
+    assets_months = []
+    for investment in list_investments:
+        asset_months = report_engine.AssetMonths()
+        asset_months.add_months(user_months.get(investment['id'], []))
+        assets_months.append(asset_months)
+    return report_engine.ReportTimelines(assets_months, key_rates)
+
+
+async def get_investment_report_timelines(user_id: int, list_investments) -> report_engine.ReportTimelines:
+    """Calculate report series of user investments from monthly aggregates"""
+    user_months = await get_user_investments_months_grouped(user_id)
+    key_rates = await get_key_rate_series()
+    with metrics.report_compute_timer(REPORT_ENGINE):
+        return build_report_timelines(user_months, list_investments, key_rates)
+
+
+async def get_investment_report_columns(user_id: int) -> dict:
+    """Get investment report as long table columns (asset, month, series) without report models"""
+    list_investments = await database.fetch_all(investments_items.select()
+                                                .where(investments_items.c.owner_id == user_id)
+                                                .order_by(investments_items.c.id))
+    timelines = await get_investment_report_timelines(user_id, list_investments)
+    return await run_in_threadpool(timelines.tidy_columns, [investment['id'] for investment in list_investments])
+
+
+def new_report_asset(investment, user_categories: dict,
+                     model=schemas.InvestmentReportAsset) -> schemas.InvestmentReportAsset:
+    """Create report asset of model with investment description and category"""
+    asset = model.construct()
+    asset.description = investment['description']
+    asset.id = investment['id']
+    asset.category_id = investment['category_id']
+    if user_categories:
+        asset.category = user_categories.get(asset.category_id, "")
+    return asset
+
+
+def fill_report_asset_python(asset: schemas.InvestmentReportAsset, list_investment_in_out,
+                             list_investment_history, list_key_rates) -> None:
+    """Calculate report asset month by month (reference implementation of report_engine)"""
+    for inout in list_investment_in_out:
+        year_mon = str(inout['date'].timetuple().tm_year) + '-'\
+                              + str(inout["date"].timetuple().tm_mon).zfill(2)
+        if inout['sum'] > 0:
+            if year_mon in asset.sum_in:
+                asset.sum_in[year_mon] += inout['sum']
+            else:
+                asset.sum_in.update({year_mon: inout['sum']})
+        elif inout['sum'] < 0:
+            if year_mon in asset.sum_out:
+                asset.sum_out[year_mon] += inout['sum']
+            else:
+                asset.sum_out.update({year_mon: inout['sum']})
+
+    for history in list_investment_history:
+        year_mon = str(history['date'].timetuple().tm_year) + '-'\
+                              + str(history["date"].timetuple().tm_mon).zfill(2)
+        asset.sum_fact.update({year_mon: history['sum']})
+
+    for key_rate_item in list_key_rates:
+        year_mon = str(key_rate_item['date'].timetuple().tm_year) + '-' \
+                   + str(key_rate_item["date"].timetuple().tm_mon).zfill(2)
+        asset.key_rates.update({year_mon: key_rate_item['key_rate']})
+
+    dates = set(asset.sum_fact.keys()) | set(asset.sum_in.keys()) | set(asset.sum_out.keys())
+    dates_sort_list = sorted(list(dates))
+
+    tmp_dates_sort_list = []
+    if len(dates_sort_list) > 0:
+        year_begin = int(dates_sort_list[0][0:4])
+        year_end = int(dates_sort_list[len(dates_sort_list) - 1][0:4])
+        for year in range(year_begin, year_end + 1):
+            for month in range(1, 13):
+                date = str(year) + "-" + str(month).zfill(2)
+                if dates_sort_list[0] <= date <= dates_sort_list[len(dates_sort_list) - 1]:
+                    tmp_dates_sort_list.append(date)
+        dates_sort_list = tmp_dates_sort_list
+
+    total_sum = 0
+    total_items = 0
+    average_sum = 0
+    average_items = 0
+    last_sum_fact = 0
+    deposit_index_sum = 0
+    last_key_rate = 4
+
+    for date in dates_sort_list:
+        total_items += 1
+
+        if date in asset.sum_in:
+            total_sum += asset.sum_in[date]
+            deposit_index_sum += asset.sum_in[date]
+
+        if date in asset.sum_out:
+            total_sum += asset.sum_out[date]
+            deposit_index_sum += asset.sum_out[date]
+
+        if date in asset.key_rates:
+            deposit_index_sum += deposit_index_sum * (asset.key_rates[date]-1) / 100 / 12
+            last_key_rate = asset.key_rates[date]
+        else:
+            deposit_index_sum += deposit_index_sum * (last_key_rate-1) / 100 / 12
+
+        asset.sum_deposit_index[date] = int(deposit_index_sum)
+        if deposit_index_sum != 0:
+            asset.ratio_deposit_index[date] = int(total_sum/deposit_index_sum * 100 - 100)
+        else:
+            asset.ratio_deposit_index[date] = 0
+
+        asset.sum_plan[date] = total_sum
+
+        if date not in asset.sum_fact:
+            asset.sum_fact[date] = last_sum_fact
+            if deposit_index_sum != 0:
+                asset.ratio_deposit_index[date] = int(last_sum_fact / deposit_index_sum * 100 - 100)
+        else:
+            last_sum_fact = asset.sum_fact[date]
+            if deposit_index_sum != 0:
+                asset.ratio_deposit_index[date] = int(asset.sum_fact[date] / deposit_index_sum * 100 - 100)
+
+        asset.sum_delta_rub[date] = asset.sum_fact[date] - total_sum
+
+        if total_sum != 0:
+            asset.sum_delta_proc[date] = round((asset.sum_fact[date] - total_sum) / total_sum * 100, 1)
+
+            average_sum += asset.sum_delta_proc[date]
+            average_items += 1
+
+            asset.sum_delta_proc_avg[date] = round(average_sum / average_items, 1)
+
+        if total_items != 0:
+            asset.sum_cashflow[date] = int((asset.sum_fact[date] - total_sum) / total_items)
+
+
+async def get_investment_report_json(user_id: int, version: tuple | None = None) -> schemas.InvestmentReport:
+    """Create investment report in json or get it from cache if user data not changed, version is taken from DB unless given by caller"""
+    if version is None:
+        version = await data_version(user_id)
+    user_report = report_cache.get(user_id, version)
+    if user_report is None:
+        user_report = await calculate_investment_report(user_id)
+        report_cache.put(user_id, version, user_report)
+    return user_report
+
+
+async def calculate_investment_report(user_id: int) -> schemas.InvestmentReport:
+    """Calculate investment report by REPORT_ENGINE"""
+    user_report = schemas.InvestmentReport.construct()
 
     # get user investments
     list_investments = await database.fetch_all(investments_items.select()
                                                 .where(investments_items.c.owner_id == user_id))
     list_categories = await database.fetch_all(categories.select().where(categories.c.owner_id == user_id))
 
-    list_key_rates = await database.fetch_all(key_rate.select())
+    key_rates = await get_key_rate_series()
 
     user_categories = {}
     for category in list_categories:
         user_categories.update({category['id']: category['category']})
 
-    for investment in list_investments:
-        asset = schemas.InvestmentReportAsset()
-        asset.description = investment['description']
-        asset.id = investment['id']
-        asset.category_id = investment['category_id']
-        if user_categories:
-            asset.category = user_categories[asset.category_id]
-
-        list_investment_in_out = await database.fetch_all(investments_in_out.select()
-                                                          .where(investments_in_out.c.investment_id == asset.id))
-
-        for inout in list_investment_in_out:
-            year_mon = str(inout['date'].timetuple().tm_year) + '-'\
-                                  + str(inout["date"].timetuple().tm_mon).zfill(2)
-            if inout['sum'] > 0:
-                if year_mon in asset.sum_in:
-                    asset.sum_in[year_mon] += inout['sum']
-                else:
-                    asset.sum_in.update({year_mon: inout['sum']})
-            elif inout['sum'] < 0:
-                if year_mon in asset.sum_out:
-                    asset.sum_out[year_mon] += inout['sum']
-                else:
-                    asset.sum_out.update({year_mon: inout['sum']})
-
-        list_investment_history = await database.fetch_all(investments_history.select()
-                                                           .where(investments_history.c.investment_id == asset.id))
-
-        for history in list_investment_history:
-            year_mon = str(history['date'].timetuple().tm_year) + '-'\
-                                  + str(history["date"].timetuple().tm_mon).zfill(2)
-            asset.sum_fact.update({year_mon: history['sum']})
-
-        for key_rate_item in list_key_rates:
-            year_mon = str(key_rate_item['date'].timetuple().tm_year) + '-' \
-                       + str(key_rate_item["date"].timetuple().tm_mon).zfill(2)
-            asset.key_rates.update({year_mon: key_rate_item['key_rate']})
-
-        dates = set(asset.sum_fact.keys()) | set(asset.sum_in.keys()) | set(asset.sum_out.keys())
-        dates_sort_list = sorted(list(dates))
-
-        tmp_dates_sort_list = []
-        if len(dates_sort_list) > 0:
-            year_begin = int(dates_sort_list[0][0:4])
-            year_end = int(dates_sort_list[len(dates_sort_list) - 1][0:4])
-            for year in range(year_begin, year_end + 1):
-                for month in range(1, 13):
-                    date = str(year) + "-" + str(month).zfill(2)
-                    if dates_sort_list[0] <= date <= dates_sort_list[len(dates_sort_list) - 1]:
-                        tmp_dates_sort_list.append(date)
-            dates_sort_list = tmp_dates_sort_list
-
-        total_sum = 0
-        total_items = 0
-        average_sum = 0
-        average_items = 0
-        last_sum_fact = 0
-        deposit_index_sum = 0
-        last_key_rate = 4
-
-        for date in dates_sort_list:
-            total_items += 1
-
-            if date in asset.sum_in:
-                total_sum += asset.sum_in[date]
-                deposit_index_sum += asset.sum_in[date]
-
-            if date in asset.sum_out:
-                total_sum += asset.sum_out[date]
-                deposit_index_sum += asset.sum_out[date]
-
-            if date in asset.key_rates:
-                deposit_index_sum += deposit_index_sum * (asset.key_rates[date]-1) / 100 / 12
-                last_key_rate = asset.key_rates[date]
-            else:
-                deposit_index_sum += deposit_index_sum * (last_key_rate-1) / 100 / 12
-
-            asset.sum_deposit_index[date] = int(deposit_index_sum)
-            if deposit_index_sum != 0:
-                asset.ratio_deposit_index[date] = int(total_sum/deposit_index_sum * 100 - 100)
-            else:
-                asset.ratio_deposit_index[date] = 0
-
-            asset.sum_plan[date] = total_sum
-
-            if date not in asset.sum_fact:
-                asset.sum_fact[date] = last_sum_fact
-                if deposit_index_sum != 0:
-                    asset.ratio_deposit_index[date] = int(last_sum_fact / deposit_index_sum * 100 - 100)
-            else:
-                last_sum_fact = asset.sum_fact[date]
-                if deposit_index_sum != 0:
-                    asset.ratio_deposit_index[date] = int(asset.sum_fact[date] / deposit_index_sum * 100 - 100)
+    if REPORT_ENGINE == 'python':
+        user_in_out = await get_user_investments_inout_grouped(user_id)
+        user_history = await get_user_investments_history_grouped(user_id)
+        with metrics.report_compute_timer(REPORT_ENGINE):
+            for investment in list_investments:
+                asset = new_report_asset(investment, user_categories)
+                fill_report_asset_python(asset, user_in_out.get(asset.id, []), user_history.get(asset.id, []),
+                                         key_rates.rows)
+                user_report.investment_report.append(asset)
+        return user_report
+
+    user_months = await get_user_investments_months_grouped(user_id)
+    with metrics.report_compute_timer(REPORT_ENGINE):
+        timelines = build_report_timelines(user_months, list_investments, key_rates)
+        for i, investment in enumerate(list_investments):
+            asset = new_report_asset(investment, user_categories)
+            timelines.fill_report_asset(asset, i)
+            user_report.investment_report.append(asset)
+    return user_report
 
-            asset.sum_delta_rub[date] = asset.sum_fact[date] - total_sum
 
-            if total_sum != 0:
-                asset.sum_delta_proc[date] = round((asset.sum_fact[date] - total_sum) / total_sum * 100, 1)
+async def get_investment_report_json_v2(user_id: int, version: tuple | None = None) -> schemas.InvestmentReportV2:
+    """Create investment report in columnar format or get it from cache if user data not changed, version is taken from DB unless given by caller"""
+    if version is None:
+        version = await data_version(user_id)
+    user_report = report_cache.get(user_id, version, "v2")
+    if user_report is None:
+        user_report = await calculate_investment_report_v2(user_id)
+        report_cache.put(user_id, version, user_report, "v2")
+    return user_report
 
-                average_sum += asset.sum_delta_proc[date]
-                average_items += 1
 
-                asset.sum_delta_proc_avg[date] = round(average_sum / average_items, 1)
+async def calculate_investment_report_v2(user_id: int) -> schemas.InvestmentReportV2:
+    """Calculate investment report in columnar format by report_engine whatever REPORT_ENGINE is"""
+    list_investments = await database.fetch_all(investments_items.select()
+                                                .where(investments_items.c.owner_id == user_id))
+    list_categories = await database.fetch_all(categories.select().where(categories.c.owner_id == user_id))
 
-            if total_items != 0:
-                asset.sum_cashflow[date] = int((asset.sum_fact[date] - total_sum) / total_items)
+    user_categories = {}
+    for category in list_categories:
+        user_categories.update({category['id']: category['category']})
 
+    timelines = await get_investment_report_timelines(user_id, list_investments)
+    user_report = schemas.InvestmentReportV2.construct(
+        start_month=timelines.axis_labels[0] if timelines.axis_labels else "",
+        months=len(timelines.axis_labels), key_rates=dict(timelines.key_rates.labeled))
+    for i, investment in enumerate(list_investments):
+        asset = new_report_asset(investment, user_categories, schemas.InvestmentReportAssetV2)
+        timelines.fill_report_asset_v2(asset, i)
         user_report.investment_report.append(asset)
     return user_report
 
 
-async def get_investment_report_xlsx(user_id: int) -> str:
-    """Create investment report in xlsx"""
-    json_report = await get_investment_report_json(user_id)
+XLSX_COLUMN_WIDTHS = {"A": 8, "B": 13, "C": 8, "D": 12, "E": 12, "F": 14,
+                      "G": 13, "H": 15, "I": 9, "J": 14, "K": 16}
+
+XLSX_TITLES = ['Дата',
+               'Пополнение',
+               'Снятие',
+               'Сумма план',
+               'Сумма факт',
+               'Прирост руб',
+               'Прирост %',
+               'Прирост средн',
+               'Cashflow',
+               'ЕслиНаВклад',
+               'ОтклОтВклада%']
 
-    wb = Workbook()
+
+def write_investment_report_xlsx(json_report: schemas.InvestmentReport, file) -> None:
+    """Write investment report to xlsx file object row by row, one sheet per asset"""
+    wb = Workbook(write_only=True)
     bold = Font(bold=True)
 
     for asset in json_report.investment_report:
-        wb.create_sheet(asset.description)
-        sht = wb[asset.description]
-        row = column = 1
-
-        column_dimensions = {"A": 8, "B": 13, "C": 8, "D": 12, "E": 12, "F": 14,
-                             "G": 13, "H": 15, "I": 9, "J": 14, "K": 16}
-    
-        for col in column_dimensions.keys():
-            sht.column_dimensions[col].width = column_dimensions[col]
-
-        titles = ['Дата',
-                  'Пополнение',
-                  'Снятие',
-                  'Сумма план',
-                  'Сумма факт',
-                  'Прирост руб',
-                  'Прирост %',
-                  'Прирост средн',
-                  'Cashflow',
-                  'ЕслиНаВклад',
-                  'ОтклОтВклада%']
-
-        for title in titles:
-            cell = sht.cell(row=row, column=column)
-            cell.value = title
+        sht = wb.create_sheet(asset.description)
+
+        for col, width in XLSX_COLUMN_WIDTHS.items():
+            sht.column_dimensions[col].width = width
+
+        titles = []
+        for title in XLSX_TITLES:
+            cell = WriteOnlyCell(sht, value=title)
             cell.font = bold
-            column += 1
+            titles.append(cell)
+        sht.append(titles)
 
-        row = 2
         for date in asset.sum_plan:
-            column = 1
-            cell = sht.cell(row=row, column=column)
-            cell.value = date
-
-            if date in asset.sum_in:
-                column = 2
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_in[date]
-
-            if date in asset.sum_out:
-                column = 3
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_out[date]
-
-            if date in asset.sum_plan:
-                column = 4
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_plan[date]
-
-            if date in asset.sum_fact:
-                column = 5
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_fact[date]
-
-            if date in asset.sum_delta_rub:
-                column = 6
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_delta_rub[date]
-
-            if date in asset.sum_delta_proc:
-                column = 7
-                cell = sht.cell(row=row, column=column)
-                cell.value = asset.sum_delta_proc[date]
-
-            if date in asset.sum_delta_proc_avg:
-                column = 8
-                cell = sht.cell(row=row, column=column)
-                cell.value = cell.value = asset.sum_delta_proc_avg[date]
-
-            if date in asset.sum_cashflow:
-                column = 9
-                cell = sht.cell(row=row, column=column)
-                cell.value = cell.value = asset.sum_cashflow[date]
-
-            if date in asset.sum_deposit_index:
-                column = 10
-                cell = sht.cell(row=row, column=column)
-                cell.value = cell.value = asset.sum_deposit_index[date]
-
-            if date in asset.ratio_deposit_index:
-                column = 11
-                cell = sht.cell(row=row, column=column)
-                cell.value = cell.value = asset.ratio_deposit_index[date]
-
-            row += 1
-
-    xlsx_file = '.' + os.sep + 'static' + os.sep + 'export' + os.sep + f'investresults{user_id}.xlsx'
-    sht = wb.get_sheet_by_name('Sheet')
-    wb.remove_sheet(sht)
-    wb.save(filename=xlsx_file)
+            sht.append([date,
+                        asset.sum_in.get(date),
+                        asset.sum_out.get(date),
+                        asset.sum_plan.get(date),
+                        asset.sum_fact.get(date),
+                        asset.sum_delta_rub.get(date),
+                        asset.sum_delta_proc.get(date),
+                        asset.sum_delta_proc_avg.get(date),
+                        asset.sum_cashflow.get(date),
+                        asset.sum_deposit_index.get(date),
+                        asset.ratio_deposit_index.get(date)])
+
+    wb.save(file)
+
+
+async def get_investment_report_xlsx(user_id: int) -> SpooledTemporaryFile:
+    """Create investment report in xlsx, file is written in worker thread and kept in memory until it grows large"""
+    json_report = await get_investment_report_json(user_id)
+    xlsx_file = SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+    try:
+        await run_in_threadpool(write_investment_report_xlsx, json_report, xlsx_file)
+    except BaseException:
+        xlsx_file.close()
+        raise
+    xlsx_file.seek(0)
     return xlsx_file
 
 
@@ -501,18 +1037,36 @@ async def add_investments_results(user_id: int, list_investments) -> dict:
     json_report = await get_investment_report_json(user_id)
 
     procs = {}
+    plans = {}
 
     for asset in json_report.investment_report:
         sum_delta_proc = 0
         for date in asset.sum_delta_proc:
             sum_delta_proc = asset.sum_delta_proc[date]
         procs[asset.id] = sum_delta_proc
+        plans[asset.id] = list(asset.sum_plan.values())[-1] if asset.sum_plan else 0
 
     result = []
     for investment in list_investments:
         investment_dict = dict(investment)
         if investment_dict['id'] in procs:
             investment_dict['proc'] = procs[investment_dict['id']]
+            investment_dict['sum_plan'] = plans[investment_dict['id']]
+        result.append(investment_dict)
+
+    return result
+
+
+async def add_investments_summary(user_id: int, list_investments) -> list:
+    """Add results to investments from monthly aggregates without calculation of report"""
+    summary = report_engine.investments_summary(await get_user_investments_months(user_id))
+
+    result = []
+    for investment in list_investments:
+        investment_dict = dict(investment)
+        investment_summary = summary.get(investment_dict['id'])
+        investment_dict['proc'] = investment_summary['proc'] if investment_summary else 0
+        investment_dict['sum_plan'] = investment_summary['sum_plan'] if investment_summary else 0
         result.append(investment_dict)
 
     return result
@@ -1,9 +1,18 @@
 import databases
 from sqlalchemy import create_engine, MetaData
+from sqlalchemy.pool import NullPool
 
-from config import SQLALCHEMY_DATABASE_URL
+from config import SQLALCHEMY_DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_STATEMENT_CACHE_SIZE, \
+    DB_CONNECTION_MAX_LIFETIME, DB_CONNECTION_MAX_QUERIES
 
-database = databases.Database(SQLALCHEMY_DATABASE_URL)
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# options of asyncpg pool, asyncpg closes connections idle for max lifetime or used for max queries
+database = databases.Database(SQLALCHEMY_DATABASE_URL,
+                              min_size=DB_POOL_MIN_SIZE,
+                              max_size=DB_POOL_MAX_SIZE,
+                              statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                              max_inactive_connection_lifetime=DB_CONNECTION_MAX_LIFETIME,
+                              max_queries=DB_CONNECTION_MAX_QUERIES)
+# synchronous engine is used only for create_all and migrations, connections are not kept
+engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
 
 metadata = MetaData()
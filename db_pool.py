@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from config import DB_POOL_ACQUIRE_TIMEOUT
+from exeptions import PoolTimeout
+from metrics import Histogram
+
+# upper bounds of acquire wait buckets in seconds
+ACQUIRE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class InstrumentedPool:
+    """asyncpg pool of databases backend with acquire timeout and statistics of waiting"""
+
+    def __init__(self, pool, acquire_timeout: float):
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0
+        self.timeouts = 0
+        self.acquire_wait = Histogram(ACQUIRE_WAIT_BUCKETS)
+
+    async def acquire(self):
+        self.waiters += 1
+        start = time.perf_counter()
+        try:
+            return await self._pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout
+        finally:
+            self.waiters -= 1
+            self.acquire_wait.observe(time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def stats(self) -> dict:
+        size = self._pool.get_size()
+        idle = self._pool.get_idle_size()
+        return {"min_size": self._pool.get_min_size(), "max_size": self._pool.get_max_size(),
+                "size": size, "in_use": size - idle, "idle": idle, "waiters": self.waiters,
+                "timeouts": self.timeouts, "acquire_wait": self.acquire_wait.stats()}
+
+
+def instrument(database) -> InstrumentedPool:
+    """Wrap pool of connected database, connections of databases are acquired through the wrapper"""
+    backend = database._backend
+    if not isinstance(backend._pool, InstrumentedPool):
+        backend._pool = InstrumentedPool(backend._pool, DB_POOL_ACQUIRE_TIMEOUT)
+    return backend._pool
+
+
+def stats(database) -> dict | None:
+    """Statistics of pool, None before connect"""
+    pool = database._backend._pool
+    return pool.stats() if isinstance(pool, InstrumentedPool) else None
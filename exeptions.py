@@ -23,4 +23,24 @@ class InvestmentNotFound(Exception):
 
 
 class KeyRateNotFound(Exception):
-    """Error - investment not found"""
\ No newline at end of file
+    """Error - investment not found"""
+
+
+class PasswordHashingBusy(Exception):
+    """Error - too many password hashing requests in queue"""
+
+
+class ImportFormatError(Exception):
+    """Error - uploaded file has wrong format"""
+
+
+class WrongCursor(Exception):
+    """Error - page cursor is broken"""
+
+
+class PoolTimeout(Exception):
+    """Error - no free DB connection in pool for acquire timeout"""
+
+
+class ImportAlreadyRunning(Exception):
+    """Error - import of user is already running"""
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from config import TEST_USER_USERNAME, TEST_USER_PASSWORD
+
+SCENARIOS = ("items", "report_json", "report_xlsx", "history_write", "inout_write")
+DEFAULT_MIX = "items=40,report_json=30,report_xlsx=10,history_write=10,inout_write=10"
+
+
+def percentile(values: list, percent: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values) + 0.5) - 1))]
+
+
+class RouteLatency:
+    """Latencies and status codes of requests of one route"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def add(self, seconds: float, status: int | None) -> None:
+        self.latencies.append(seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status is None or status >= 400:
+            self.errors += 1
+
+    def stats(self, duration: float) -> dict:
+        latencies = sorted(self.latencies)
+        return {"requests": len(latencies), "errors": self.errors, "rps": len(latencies) / duration,
+                "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else 0.0,
+                "statuses": {str(status): count for status, count in self.statuses.items()}}
+
+
+class LoadTest:
+    """Virtual users replaying weighted mix of API calls until duration or request count is reached"""
+
+    def __init__(self, socket: str, username: str, password: str, mix: dict,
+                 duration: float | None = None, requests: int | None = None, seed: int = 0):
+        self.socket = socket
+        self.username = username
+        self.password = password
+        self.scenarios = list(mix)
+        self.weights = list(mix.values())
+        self.duration = duration
+        self.requests = requests
+        self.rnd = random.Random(seed)
+        self.routes = {}
+        self.started = 0
+        self.deadline = None
+
+    def next_request(self) -> bool:
+        """Reserve one more scenario run, False when test is over"""
+        if self.requests is not None:
+            if self.started >= self.requests:
+                return False
+        elif time.perf_counter() >= self.deadline:
+            return False
+        self.started += 1
+        return True
+
+    async def call(self, client: httpx.AsyncClient, route: str, method: str, url: str,
+                   **kwargs) -> httpx.Response | None:
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await client.request(method, url, **kwargs)
+            await response.aread()
+        except httpx.HTTPError:
+            pass
+        latency = self.routes.setdefault(f"{method} {route}", RouteLatency())
+        latency.add(time.perf_counter() - start, response.status_code if response is not None else None)
+        return response
+
+    async def login(self, client: httpx.AsyncClient) -> int:
+        response = await self.call(client, "/api/token", "POST", "/api/token",
+                                   data={"username": self.username, "password": self.password})
+        if response is None or response.status_code != 200:
+            raise RuntimeError(f"login of {self.username} failed: "
+                               f"{response.status_code if response is not None else 'no response'}")
+        client.headers["Authorization"] = f'Bearer {response.json()["access_token"]}'
+        response = await self.call(client, "/api/user", "GET", "/api/user")
+        return response.json()["id"]
+
+    async def items(self, client: httpx.AsyncClient, user_id: int, investments: list) -> None:
+        response = await self.call(client, "/api/users/investment_items/", "GET", "/api/users/investment_items/",
+                                   params={"user_id": user_id})
+        if response is not None and response.status_code == 200:
+            investments[:] = [item["id"] for item in response.json()["investments"]]
+
+    async def report_json(self, client: httpx.AsyncClient, user_id: int, investments: list) -> None:
+        await self.call(client, "/api/users/reports/json/", "GET", "/api/users/reports/json/",
+                        params={"user_id": user_id})
+
+    async def report_xlsx(self, client: httpx.AsyncClient, user_id: int, investments: list) -> None:
+        await self.call(client, "/api/users/reports/xlsx/", "GET", "/api/users/reports/xlsx/",
+                        params={"user_id": user_id})
+
+    async def write(self, client: httpx.AsyncClient, user_id: int, investments: list, path: str, id_param: str,
+                    item: dict) -> None:
+        """Create row of random investment and delete it, data of user stays the same"""
+        if not investments:
+            return
+        item = {**item, "investment_id": self.rnd.choice(investments),
+                "date": datetime.now(timezone.utc).isoformat()}
+        response = await self.call(client, path, "POST", path, params={"user_id": user_id}, json=item)
+        if response is not None and response.status_code == 200:
+            await self.call(client, path, "DELETE", path, params={"user_id": user_id, id_param: response.json()["id"]})
+
+    async def history_write(self, client: httpx.AsyncClient, user_id: int, investments: list) -> None:
+        await self.write(client, user_id, investments, "/api/users/investment_history/", "investment_history_id",
+                         {"sum": self.rnd.randint(1, 1000) * 1000})
+
+    async def inout_write(self, client: httpx.AsyncClient, user_id: int, investments: list) -> None:
+        await self.write(client, user_id, investments, "/api/users/investment_inout/", "investment_in_out_id",
+                         {"sum": self.rnd.randint(1, 100) * 1000, "description": "Пополнение"})
+
+    async def virtual_user(self) -> None:
+        async with httpx.AsyncClient(base_url=self.socket, timeout=60) as client:
+            user_id = await self.login(client)
+            investments = []
+            await self.items(client, user_id, investments)
+            while self.next_request():
+                scenario = self.rnd.choices(self.scenarios, self.weights)[0]
+                await getattr(self, scenario)(client, user_id, investments)
+
+    async def run(self, users: int) -> dict:
+        start = time.perf_counter()
+        self.deadline = start + (self.duration or 0)
+        results = await asyncio.gather(*(self.virtual_user() for _ in range(users)), return_exceptions=True)
+        duration = time.perf_counter() - start
+        failed = [str(result) for result in results if isinstance(result, Exception)]
+        routes = {route: latency.stats(duration) for route, latency in sorted(self.routes.items())}
+        return {"date": datetime.now(timezone.utc).isoformat(), "socket": self.socket, "users": users,
+                "mix": dict(zip(self.scenarios, self.weights)), "duration": duration,
+                "requests": sum(route["requests"] for route in routes.values()),
+                "rps": sum(route["requests"] for route in routes.values()) / duration,
+                "failed_users": failed, "routes": routes}
+
+
+def parse_mix(mix: str) -> dict:
+    """Weights of scenarios from string like items=40,report_json=30"""
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def print_report(report: dict) -> None:
+    print(f'{report["users"]} users, {report["requests"]} requests in {report["duration"]:.1f} s, '
+          f'{report["rps"]:.1f} requests/s')
+    print(f'{"route":<45} {"requests":>8} {"errors":>6} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for route, stats in report["routes"].items():
+        print(f'{route:<45} {stats["requests"]:>8} {stats["errors"]:>6} {stats["rps"]:>8.1f} '
+              f'{stats["p50"] * 1000:>8.1f} {stats["p95"] * 1000:>8.1f} {stats["p99"] * 1000:>8.1f}')
+    for error in report["failed_users"]:
+        print(f'virtual user failed: {error}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of local API with concurrent virtual users "
+                                                 "(run against a scratch DB, writes are deleted again)")
+    parser.add_argument("--socket", default="http://localhost:8000")
+    parser.add_argument("--username", default=TEST_USER_USERNAME)
+    parser.add_argument("--password", default=TEST_USER_PASSWORD)
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"weights of scenarios, {DEFAULT_MIX} by default")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--duration", type=float, help="seconds to run, 60 by default")
+    mode.add_argument("--requests", type=int, help="scenario runs of all users to make")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save report as json")
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.duration = 60
+    load_test = LoadTest(args.socket, args.username, args.password, args.mix, args.duration, args.requests, args.seed)
+    result = asyncio.run(load_test.run(args.users))
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2, ensure_ascii=False)
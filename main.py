@@ -1,33 +1,47 @@
 #!/usr/bin/python3
 
-import os
 import asyncio
+import asyncpg
+import os
+import time
 import uvicorn
 
 from datetime import datetime, timedelta
+from typing import List
 
 from database import database, engine, metadata
-from fastapi import Depends, FastAPI, HTTPException, status
+from migrations import migrate
+from fastapi import Depends, FastAPI, File, Header, HTTPException, Query, UploadFile, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
+import compression
 import crud
+import db_pool
+import metrics
+import sql_trace
 import schemas
+from report_cache import report_cache, data_etag
+from principal_cache import principal_cache, request_user
+import password_hashing
+import report_export
+from fast_json import FastJSONResponse
+from throttling import ClientIpMiddleware, failure_limiter, client_ip
 
-from config import SECRET_KEY, MY_INVITE, DEMO_USER_ID, EXCEPTION_PER_SEC_LIMIT, \
-    ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import SECRET_KEY, MY_INVITE, DEMO_USER_ID, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, BATCH_MAX_ITEMS, \
+    DB_POOL_READY_MAX_WAITERS, SQL_TRACE
 
 from exeptions import DBNoConnection, TooShortPassword, UserPasswordIsInvalid, CategoryInUse, CategoryNotFound, \
-    InvestmentNotFound
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    InvestmentNotFound, PasswordHashingBusy, ImportFormatError, WrongCursor, PoolTimeout, ImportAlreadyRunning
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/token")
 
+REPORT_V2_MEDIA_TYPE = "application/vnd.investresults.report.v2+json"
+
 metadata.create_all(bind=engine)
+migrate()
 
 tags_metadata = [
     {
@@ -66,6 +80,14 @@ tags_metadata = [
         "name": "Reports",
         "description": "Отчеты",
     },
+    {
+        "name": "Import",
+        "description": "Загрузка истории из отчета xlsx или csv",
+    },
+    {
+        "name": "Health",
+        "description": "Готовность сервиса и пула соединений с БД",
+    },
 ]
 
 app = FastAPI(
@@ -73,6 +95,11 @@ app = FastAPI(
     version="1.0.0",
     openapi_tags=tags_metadata,
 )
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(ClientIpMiddleware)
+if SQL_TRACE:
+    app.add_middleware(sql_trace.SqlTraceMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.on_event("startup")
@@ -81,6 +108,9 @@ async def startup() -> None:
         await database.connect()
     except BaseException:
         raise DBNoConnection
+    db_pool.instrument(database)
+    metrics.observe_queries(database)
+    sql_trace.observe_queries(database)
 
 
 @app.on_event("shutdown")
@@ -91,24 +121,45 @@ async def shutdown() -> None:
         raise DBNoConnection
 
 
-def get_password_hash(password: str) -> str:
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_exception_handler(request, exc) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"detail": "Database is busy, try again later"},
+                        headers={"Retry-After": "1"})
+
+
+async def get_password_hash(password: str) -> str:
     """Make hashed password from plain"""
     if len(password) > 5:
-        return pwd_context.hash(password)
+        return await password_hashing.hash_password(password)
     else:
         raise TooShortPassword
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify user plain password with hashed password"""
-    #print(get_password_hash(plain_password))
-    return pwd_context.verify(plain_password, hashed_password)
+    return await password_hashing.verify_password(plain_password, hashed_password)
+
+
+def password_hashing_busy_exception() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Too many login requests, try again later",
+                         headers={"Retry-After": "1"})
+
+
+def check_failure_limit(*keys) -> None:
+    """Reject request at once if client or user failed too often"""
+    retry_after = failure_limiter.retry_after(*keys)
+    if retry_after:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="Too many failed requests, try again later",
+                            headers={"Retry-After": str(retry_after)})
 
 
 async def authenticate_user(username: str, password: str) -> schemas.UserInDB:
     """Authenticate user and get user info from DB"""
     user = await crud.get_user(username=username)
-    if user and verify_password(password, user.hashed_password):
+    if user and await verify_password(password, user.hashed_password):
         return user
     else:
         raise UserPasswordIsInvalid
@@ -141,8 +192,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> schemas.UserI
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await crud.get_user(username=token_data.username)
+    user = principal_cache.get(username=token_data.username)
+    if user is None:
+        user = await crud.get_user(username=token_data.username)
+        if user:
+            principal_cache.put(user)
     if user:
+        request_user.set(user)
         return user
     else:
         raise credentials_exception
@@ -155,17 +211,64 @@ async def get_current_active_user(current_user: schemas.UserInDB = Depends(get_c
     return current_user
 
 
+async def get_current_admin_user(current_user: schemas.UserInDB =
+                                 Depends(get_current_active_user)) -> schemas.UserInDB:
+    """Check user - administrator or not"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Administrators only")
+    return current_user
+
+
 async def is_user(user_id: int, email: str) -> schemas.UserInDB:
     """Validate user by id and email"""
-    db_user = await crud.get_user(user_id=user_id)
+    failure_keys = (('user', email),)
+    check_failure_limit(*failure_keys)
+    db_user = request_user.get()
+    if db_user is None or db_user.id != user_id:
+        db_user = principal_cache.get(user_id=user_id)
+    if db_user is None:
+        db_user = await crud.get_user(user_id=user_id)
+        if db_user:
+            principal_cache.put(db_user)
     if not db_user:
-        await asyncio.sleep(EXCEPTION_PER_SEC_LIMIT)
+        failure_limiter.failure(*failure_keys)
         raise HTTPException(status_code=404, detail="User not found")
     if db_user.email != email:
-        await asyncio.sleep(EXCEPTION_PER_SEC_LIMIT)
+        failure_limiter.failure(*failure_keys)
         raise HTTPException(status_code=404, detail="Query for other user prohibited")
     return db_user
 
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def not_modified(if_none_match: str | None, etag: str) -> Response | None:
+    """Response 304 if If-None-Match has etag (weak comparison as for GET), otherwise None"""
+    if if_none_match is None:
+        return None
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+    return None
+
+
+def check_batch_size(items: list) -> None:
+    """Reject too large batch of items"""
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+
+
+def check_batch_ids(items: list) -> None:
+    """Reject batch changing same row twice"""
+    if len({item.id for item in items}) < len(items):
+        raise HTTPException(status_code=400, detail="Repeated id in batch")
+
+
+def demo_batch_result(items: list) -> schemas.BatchResult:
+    return schemas.BatchResult(processed=len(items),
+                               items=[schemas.BatchItemResult(index=index, id=9999999) for index in range(len(items))])
+
 '''
 @app.get("/")
 async def redirect_to_index_html():
@@ -174,10 +277,14 @@ async def redirect_to_index_html():
 
 @app.post("/api/register", response_model=schemas.User, tags=["Register"])
 async def create_user(user: schemas.UserCreate) -> schemas.User:
+    check_failure_limit(('ip', client_ip.get()))
     if not await crud.get_user(email=user.email):
-        hashed_password = get_password_hash(user.password)
+        try:
+            hashed_password = await get_password_hash(user.password)
+        except PasswordHashingBusy:
+            raise password_hashing_busy_exception()
         if user.invite != MY_INVITE:
-            await asyncio.sleep(EXCEPTION_PER_SEC_LIMIT)
+            failure_limiter.failure(('ip', client_ip.get()))
             raise HTTPException(status_code=400, detail="Invite is broken")
         return await crud.create_user(user=user, hashed_password=hashed_password)
     else:
@@ -186,11 +293,15 @@ async def create_user(user: schemas.UserCreate) -> schemas.User:
 
 @app.post("/api/token", response_model=schemas.Token, tags=["Token"])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()) -> schemas.Token:
-    print(form_data.username, form_data.password)
+    start = time.perf_counter()
+    failure_keys = (('ip', client_ip.get()), ('username', form_data.username))
+    check_failure_limit(*failure_keys)
     try:
         user = await authenticate_user(form_data.username, form_data.password)
+    except PasswordHashingBusy:
+        raise password_hashing_busy_exception()
     except UserPasswordIsInvalid:
-        await asyncio.sleep(EXCEPTION_PER_SEC_LIMIT)
+        failure_limiter.failure(*failure_keys)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -200,6 +311,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
+    password_hashing.login_latency.observe(time.perf_counter() - start)
     return schemas.Token(**{"access_token": access_token, "token_type": "bearer"})
 
 
@@ -218,11 +330,13 @@ async def create_investment_for_user(user_id: int, investment: schemas.Investmen
 
 
 @app.get("/api/users/investment_items/", response_model=schemas.InvestmentUser, tags=["Investments"])
-async def get_investments_for_user(user_id: int,
+async def get_investments_for_user(user_id: int, response: Response, if_none_match: str | None = Header(None),
                                    current_user: schemas.User =
                                    Depends(get_current_active_user)) -> schemas.InvestmentUser:
     await is_user(user_id, current_user.email)
-    return await crud.get_user_investment_items(user_id=user_id)
+    etag = data_etag("investment_items", await crud.data_version(user_id))
+    response.headers.update(etag_headers(etag))
+    return not_modified(if_none_match, etag) or await crud.get_user_investment_items(user_id=user_id)
 
 
 @app.put("/api/users/investment_items/", response_model=schemas.Result, tags=["Investments"])
@@ -266,15 +380,28 @@ async def create_investment_history_for_user(user_id: int, investment: schemas.H
 
 
 @app.get("/api/users/investment_history/", response_model=schemas.HistoryUser, tags=["History"])
-async def get_investments_history_for_user(user_id: int, investment_id: int,
+async def get_investments_history_for_user(user_id: int, investment_id: int, date_from: datetime | None = None,
+                                           date_to: datetime | None = None, cursor: str | None = None,
+                                           limit: int | None = Query(None, ge=1),
+                                           if_none_match: str | None = Header(None),
                                            current_user: schemas.User =
                                            Depends(get_current_active_user)) -> schemas.HistoryUser:
     await is_user(user_id, current_user.email)
+    etag = data_etag("investment_history", await crud.data_version(user_id),
+                     {"investment_id": investment_id, "date_from": date_from, "date_to": date_to,
+                      "cursor": cursor, "limit": limit})
+    response = not_modified(if_none_match, etag)
+    if response is not None:
+        return response
     try:
-        result = await crud.get_user_investment_history(user_id=user_id, investment_id=investment_id)
+        result = await crud.get_user_investment_history(user_id=user_id, investment_id=investment_id,
+                                                        date_from=date_from, date_to=date_to,
+                                                        cursor=cursor, limit=limit)
     except InvestmentNotFound:
         raise HTTPException(status_code=400, detail="Investment id not found")
-    return result
+    except WrongCursor:
+        raise HTTPException(status_code=400, detail="Wrong cursor")
+    return FastJSONResponse(result, headers=etag_headers(etag))
 
 
 @app.put("/api/users/investment_history/", response_model=schemas.Result, tags=["History"])
@@ -306,6 +433,40 @@ async def delete_investment_history_for_user(user_id: int, investment_history_id
     return result
 
 
+@app.post("/api/users/investment_history/batch/", response_model=schemas.BatchResult, tags=["History"])
+async def create_investment_history_batch_for_user(user_id: int, items: List[schemas.HistoryCreate],
+                                                   current_user: schemas.User =
+                                                   Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.create_user_investment_history_batch(items=items, user_id=user_id)
+
+
+@app.put("/api/users/investment_history/batch/", response_model=schemas.BatchResult, tags=["History"])
+async def update_investment_history_batch_for_user(user_id: int, items: List[schemas.HistoryOut],
+                                                   current_user: schemas.User =
+                                                   Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    check_batch_ids(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.update_user_investment_history_batch(items=items, user_id=user_id)
+
+
+@app.delete("/api/users/investment_history/batch/", response_model=schemas.BatchResult, tags=["History"])
+async def delete_investment_history_batch_for_user(user_id: int, items: List[schemas.HistoryDelete],
+                                                   current_user: schemas.User =
+                                                   Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.delete_user_investment_history_batch(ids=[item.id for item in items], user_id=user_id)
+
+
 @app.post("/api/users/investment_inout/", response_model=schemas.InOutInDB, tags=["In/Out"])
 async def create_investment_inout_for_user(user_id: int, investment: schemas.InOutCreate,
                                              current_user: schemas.User =
@@ -321,15 +482,28 @@ async def create_investment_inout_for_user(user_id: int, investment: schemas.InO
 
 
 @app.get("/api/users/investment_inout/", response_model=schemas.InOutUser, tags=["In/Out"])
-async def get_investments_inout_for_user(user_id: int, investment_id: int,
+async def get_investments_inout_for_user(user_id: int, investment_id: int, date_from: datetime | None = None,
+                                         date_to: datetime | None = None, cursor: str | None = None,
+                                         limit: int | None = Query(None, ge=1),
+                                         if_none_match: str | None = Header(None),
                                          current_user: schemas.User =
                                          Depends(get_current_active_user)) -> schemas.InOutUser:
     await is_user(user_id, current_user.email)
+    etag = data_etag("investment_inout", await crud.data_version(user_id),
+                     {"investment_id": investment_id, "date_from": date_from, "date_to": date_to,
+                      "cursor": cursor, "limit": limit})
+    response = not_modified(if_none_match, etag)
+    if response is not None:
+        return response
     try:
-        result = await crud.get_user_investment_inout(user_id=user_id, investment_id=investment_id)
+        result = await crud.get_user_investment_inout(user_id=user_id, investment_id=investment_id,
+                                                      date_from=date_from, date_to=date_to,
+                                                      cursor=cursor, limit=limit)
     except InvestmentNotFound:
         raise HTTPException(status_code=400, detail="Investment id not found")
-    return result
+    except WrongCursor:
+        raise HTTPException(status_code=400, detail="Wrong cursor")
+    return FastJSONResponse(result, headers=etag_headers(etag))
 
 
 @app.put("/api/users/investment_inout/", response_model=schemas.Result, tags=["In/Out"])
@@ -361,11 +535,47 @@ async def delete_investment_inout_for_user(user_id: int, investment_in_out_id: i
     return result
 
 
+@app.post("/api/users/investment_inout/batch/", response_model=schemas.BatchResult, tags=["In/Out"])
+async def create_investment_inout_batch_for_user(user_id: int, items: List[schemas.InOutCreate],
+                                                 current_user: schemas.User =
+                                                 Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.create_user_investment_inout_batch(items=items, user_id=user_id)
+
+
+@app.put("/api/users/investment_inout/batch/", response_model=schemas.BatchResult, tags=["In/Out"])
+async def update_investment_inout_batch_for_user(user_id: int, items: List[schemas.InOutOut],
+                                                 current_user: schemas.User =
+                                                 Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    check_batch_ids(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.update_user_investment_inout_batch(items=items, user_id=user_id)
+
+
+@app.delete("/api/users/investment_inout/batch/", response_model=schemas.BatchResult, tags=["In/Out"])
+async def delete_investment_inout_batch_for_user(user_id: int, items: List[schemas.InOutDelete],
+                                                 current_user: schemas.User =
+                                                 Depends(get_current_active_user)) -> schemas.BatchResult:
+    await is_user(user_id, current_user.email)
+    check_batch_size(items)
+    if user_id == DEMO_USER_ID:
+        return demo_batch_result(items)
+    return await crud.delete_user_investment_inout_batch(ids=[item.id for item in items], user_id=user_id)
+
+
 @app.get("/api/users/categories/", response_model=schemas.CategoryUser, tags=["Categories"])
-async def get_categories_for_user(user_id: int,
+async def get_categories_for_user(user_id: int, response: Response, if_none_match: str | None = Header(None),
                                   current_user: schemas.User = Depends(get_current_active_user)) -> schemas.CategoryUser:
     await is_user(user_id, current_user.email)
-    return await crud.get_user_categories(user_id=user_id)
+    etag = data_etag("categories", await crud.data_version(user_id))
+    response.headers.update(etag_headers(etag))
+    return not_modified(if_none_match, etag) or await crud.get_user_categories(user_id=user_id)
 
 
 @app.post("/api/users/categories/", response_model=schemas.CategoryInDB, tags=["Categories"])
@@ -406,10 +616,13 @@ async def delete_category_for_user(user_id: int, category_id: int,
 
 
 @app.get("/api/key_rates/", response_model=schemas.KeyRateUser, tags=["Key Rates"])
-async def get_investments_for_user(user_id: int, current_user: schemas.User =
+async def get_investments_for_user(user_id: int, response: Response, if_none_match: str | None = Header(None),
+                                   current_user: schemas.User =
                                    Depends(get_current_active_user)) -> schemas.KeyRateUser:
     await is_user(user_id, current_user.email)
-    return await crud.get_key_rate()
+    etag = data_etag("key_rates", (await crud.key_rates_version(),))
+    response.headers.update(etag_headers(etag))
+    return not_modified(if_none_match, etag) or await crud.get_key_rate()
 
 
 @app.post("/api/key_rates/", response_model=schemas.KeyRateInDB, tags=["Key Rates"])
@@ -422,24 +635,129 @@ async def create_category_for_user(user_id: int, keyrate: schemas.KeyRateCreate,
 
 
 @app.get("/api/users/reports/json/", tags=["Reports"])
-async def get_reports(user_id: int,
+async def get_reports(user_id: int, version: int = Query(1, ge=1, le=2), accept: str | None = Header(None),
+                      if_none_match: str | None = Header(None),
                       current_user: schemas.User = Depends(get_current_active_user)) -> schemas.InvestmentReport:
     await is_user(user_id, current_user.email)
-    return await crud.get_investment_report_json(user_id=user_id)
+    # columnar v2 format by ?version=2 or by Accept: application/vnd.investresults.report.v2+json
+    v2 = version == 2 or (accept is not None and REPORT_V2_MEDIA_TYPE in accept)
+    # one version for ETag and report cache, so body and ETag always match
+    data_version = await crud.data_version(user_id)
+    etag = data_etag("report_v2" if v2 else "report", data_version)
+    response = not_modified(if_none_match, etag)
+    if response is not None:
+        response.headers["Vary"] = "Accept"
+        return response
+    headers = {**etag_headers(etag), "Vary": "Accept"}
+    if v2:
+        return FastJSONResponse(await crud.get_investment_report_json_v2(user_id=user_id, version=data_version),
+                                media_type=REPORT_V2_MEDIA_TYPE, headers=headers)
+    return FastJSONResponse(await crud.get_investment_report_json(user_id=user_id, version=data_version),
+                            headers=headers)
 
 
 @app.get("/api/users/reports/xlsx/", tags=["Reports"])
 async def get_reports(user_id: int,
-                      current_user: schemas.User = Depends(get_current_active_user)) -> FileResponse:
+                      current_user: schemas.User = Depends(get_current_active_user)) -> StreamingResponse:
     await is_user(user_id, current_user.email)
-    filename_in = await crud.get_investment_report_xlsx(user_id=user_id)
+    xlsx_file = await crud.get_investment_report_xlsx(user_id=user_id)
     this_month = str(datetime.now())
     filename_out = f'investresults{this_month[:10]}.xlsx'
-    return FileResponse(path=filename_in, filename=filename_out,
-                        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    return StreamingResponse(iterate_file(xlsx_file),
+                             media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                             headers={"Content-Disposition": f'attachment; filename="{filename_out}"'})
+
+
+@app.get("/api/users/reports/table/", tags=["Reports"])
+async def get_reports_table(user_id: int, report_format: str = Query("csv", alias="format", regex="^(csv|arrow|feather)$"),
+                            current_user: schemas.User = Depends(get_current_active_user)) -> Response:
+    await is_user(user_id, current_user.email)
+    columns = await crud.get_investment_report_columns(user_id=user_id)
+    media_type = report_export.MEDIA_TYPES[report_format]
+    if report_format == "csv":
+        return StreamingResponse(report_export.iterate_csv(columns), media_type=media_type)
+    content = await run_in_threadpool(report_export.arrow_ipc, columns, report_format == "feather")
+    return Response(content=content, media_type=media_type)
+
+
+@app.post("/api/users/import/", response_model=schemas.ImportResult, tags=["Import"])
+async def import_investments_for_user(user_id: int, file: UploadFile = File(...),
+                                      import_format: str = Query("xlsx", alias="format", regex="^(xlsx|csv)$"),
+                                      current_user: schemas.User =
+                                      Depends(get_current_active_user)) -> schemas.ImportResult:
+    await is_user(user_id, current_user.email)
+    if user_id == DEMO_USER_ID:
+        return schemas.ImportResult(done=True)
+    if user_id in crud.import_progress:
+        raise HTTPException(status_code=409, detail="Import is already running")
+    try:
+        result = await crud.import_user_investments(file=file.file, file_format=import_format, user_id=user_id)
+    except ImportFormatError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except ImportAlreadyRunning:
+        raise HTTPException(status_code=409, detail="Import is already running")
+    finally:
+        await file.close()
+    return result
+
+
+@app.get("/api/users/import/", response_model=schemas.ImportResult, tags=["Import"])
+async def get_import_progress_for_user(user_id: int,
+                                       current_user: schemas.User =
+                                       Depends(get_current_active_user)) -> schemas.ImportResult:
+    await is_user(user_id, current_user.email)
+    progress = crud.import_progress.get(user_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Import is not running")
+    return progress
+
+
+def iterate_file(file, chunk_size: int = 64 * 1024):
+    """Read file by chunks and close it, StreamingResponse runs it in threadpool"""
+    try:
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+@app.get("/api/token/stats/", tags=["Token"])
+async def get_password_hashing_stats(current_user: schemas.User = Depends(get_current_admin_user)) -> dict:
+    return {**password_hashing.stats(), "failure_limiter": failure_limiter.stats()}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def get_readiness() -> JSONResponse:
+    """Ready if requests do not queue for connections of pool and DB answers"""
+    pool = db_pool.stats(database)
+    saturated = pool is None or pool["waiters"] > DB_POOL_READY_MAX_WAITERS
+    database_ok = False
+    if not saturated:
+        try:
+            database_ok = await database.fetch_val("SELECT 1") == 1
+        except (PoolTimeout, OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+            pass
+    ready = database_ok and not saturated
+    return JSONResponse(status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"ready": ready, "database": database_ok, "saturated": saturated, "pool": pool})
+
+
+@app.get("/metrics", tags=["Health"])
+async def get_metrics() -> Response:
+    return Response(content=metrics.render(db_pool.stats(database)), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/database/pool/", tags=["Health"])
+async def get_database_pool_stats(current_user: schemas.User = Depends(get_current_admin_user)) -> dict:
+    return db_pool.stats(database)
+
+
+@app.get("/api/reports/cache/", tags=["Reports"])
+async def get_report_cache_stats(current_user: schemas.User = Depends(get_current_admin_user)) -> dict:
+    return report_cache.stats()
 
 
-app.mount("/", StaticFiles(directory="static"), name="static")
+app.mount("/", compression.PrecompressedStaticFiles(directory="static"), name="static")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import bisect
+import functools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.routing import Mount
+
+# upper bounds of latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# [queries, seconds] of DB queries of current request
+request_db: ContextVar = ContextVar('request_db', default=None)
+
+# methods of databases.Database running queries
+QUERY_METHODS = ("fetch_all", "fetch_one", "fetch_val", "execute", "execute_many")
+
+
+class Histogram:
+    """Counts of observed values by upper bounds of buckets, last bucket is +Inf"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def stats(self) -> dict:
+        """Cumulative counts by bucket bound like in Prometheus"""
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": self.total, "buckets": buckets}
+
+
+class RouteStats:
+    """Requests, errors, latency and DB usage of one route"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.errors = 0
+        self.latency = Histogram()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+
+routes = {}
+report_compute = {}
+# requests being handled now
+in_progress = 0
+
+
+def resident_memory() -> int | None:
+    """Resident memory of process in bytes, None where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, db: list) -> None:
+    stats = routes.get((method, route))
+    if stats is None:
+        stats = routes[(method, route)] = RouteStats()
+    stats.statuses[status] = stats.statuses.get(status, 0) + 1
+    if status >= 500:
+        stats.errors += 1
+    stats.latency.observe(seconds)
+    stats.db_queries += db[0]
+    stats.db_seconds += db[1]
+
+
+def observe_query(seconds: float) -> None:
+    """Add DB query to statistics of current request"""
+    db = request_db.get()
+    if db is not None:
+        db[0] += 1
+        db[1] += seconds
+
+
+@contextmanager
+def report_compute_timer(engine: str):
+    """Observe time of report calculation by engine"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram = report_compute.get(engine)
+        if histogram is None:
+            histogram = report_compute[engine] = Histogram()
+        histogram.observe(time.perf_counter() - start)
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            observe_query(time.perf_counter() - start)
+    timed.timed_query = True
+    return timed
+
+
+def observe_queries(database) -> None:
+    """Add count and time of queries of database to statistics of current request"""
+    for name in QUERY_METHODS:
+        method = getattr(database, name)
+        if not getattr(method, "timed_query", False):
+            setattr(database, name, _timed(method))
+
+
+# route templates by endpoints of application routes
+_route_paths = {}
+
+
+def route_template(scope) -> str:
+    """Template of matched route, known after router saved endpoint to scope"""
+    if not _route_paths:
+        for route in scope["app"].routes:
+            if isinstance(route, Mount):
+                _route_paths[route.app] = route.path + "/{path:path}"
+            else:
+                _route_paths[route.endpoint] = route.path
+    endpoint = scope.get("endpoint")
+    return _route_paths.get(endpoint, "other") if endpoint else "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests, errors, latency and DB queries by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        db = [0, 0.0]
+        request_db.set(db)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        global in_progress
+        in_progress += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress -= 1
+            observe_request(scope["method"], route_template(scope), status, time.perf_counter() - start, db)
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def _histogram(lines: list, name: str, stats: dict, **labels) -> None:
+    for bound, count in stats["buckets"].items():
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+    lines.append(f"{name}_sum{_labels(**labels) if labels else ''} {stats['sum']}")
+    lines.append(f"{name}_count{_labels(**labels) if labels else ''} {stats['count']}")
+
+
+def render(pool: dict | None = None) -> str:
+    """Metrics in Prometheus text format"""
+    lines = ["# TYPE http_requests_total counter"]
+    for (method, route), stats in routes.items():
+        for status, count in stats.statuses.items():
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+    lines.append("# TYPE http_request_errors_total counter")
+    for (method, route), stats in routes.items():
+        lines.append(f"http_request_errors_total{_labels(method=method, route=route)} {stats.errors}")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), stats in routes.items():
+        _histogram(lines, "http_request_duration_seconds", stats.latency.stats(), method=method, route=route)
+    lines.append("# TYPE http_request_db_queries_total counter")
+    for (method, route), stats in routes.items():
+        lines.append(f"http_request_db_queries_total{_labels(method=method, route=route)} {stats.db_queries}")
+    lines.append("# TYPE http_request_db_seconds_total counter")
+    for (method, route), stats in routes.items():
+        lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {stats.db_seconds}")
+    lines.append("# TYPE report_compute_seconds histogram")
+    for engine, histogram in report_compute.items():
+        _histogram(lines, "report_compute_seconds", histogram.stats(), engine=engine)
+    lines.append("# TYPE http_requests_in_progress gauge")
+    lines.append(f"http_requests_in_progress {in_progress}")
+    memory = resident_memory()
+    if memory is not None:
+        lines.append("# TYPE process_resident_memory_bytes gauge")
+        lines.append(f"process_resident_memory_bytes {memory}")
+    if pool is not None:
+        for name in ("size", "in_use", "idle", "waiters"):
+            lines.append(f"# TYPE db_pool_{name} gauge")
+            lines.append(f"db_pool_{name} {pool[name]}")
+        lines.append("# TYPE db_pool_acquire_timeouts_total counter")
+        lines.append(f"db_pool_acquire_timeouts_total {pool['timeouts']}")
+        lines.append("# TYPE db_pool_acquire_wait_seconds histogram")
+        _histogram(lines, "db_pool_acquire_wait_seconds", pool["acquire_wait"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+import re
+
+from sqlalchemy import text
+
+from crud import investments_months_query
+from database import engine, metadata
+
+# (version, description, statements), applied in order of versions, each version once
+MIGRATIONS = [
+    (1, "indexes for investment list, reports, history and in/out", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_investments_history_investment_id_date "
+        "ON investments_history (investment_id, date, id) INCLUDE (sum)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_investments_in_out_investment_id_date "
+        "ON investments_in_out (investment_id, date, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_investments_items_owner_id ON investments_items (owner_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_categories_owner_id ON categories (owner_id)",
+    ]),
+    (2, "monthly aggregates of history and in/out, backfilled from existing rows", [
+        "CREATE TABLE IF NOT EXISTS investments_months ("
+        "id serial PRIMARY KEY, "
+        "investment_id integer NOT NULL REFERENCES investments_items(id) ON DELETE CASCADE, "
+        "month date NOT NULL, sum_in bigint NOT NULL DEFAULT 0, sum_out bigint NOT NULL DEFAULT 0, "
+        "sum_fact integer, first_in_id integer, first_out_id integer, first_fact_id integer, "
+        "UNIQUE (investment_id, month))",
+        # table of create_all before first_*_id columns
+        "ALTER TABLE investments_months ADD COLUMN IF NOT EXISTS first_in_id integer, "
+        "ADD COLUMN IF NOT EXISTS first_out_id integer, ADD COLUMN IF NOT EXISTS first_fact_id integer",
+        # months of reports are taken in UTC
+        "SET LOCAL TIME ZONE 'UTC'",
+        investments_months_query(),
+    ]),
+    (3, "data versions shared by all processes, administrators", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin boolean NOT NULL DEFAULT false, "
+        "ADD COLUMN IF NOT EXISTS data_version bigint NOT NULL DEFAULT 0",
+        "CREATE TABLE IF NOT EXISTS global_data_version (id integer PRIMARY KEY, version bigint NOT NULL DEFAULT 0)",
+        "INSERT INTO global_data_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING",
+    ]),
+]
+
+
+# migrations building indexes by CREATE INDEX CONCURRENTLY, which does not block writes of tables,
+# their statements run outside of transaction one by one
+CONCURRENT_MIGRATIONS = {1}
+
+# key of advisory lock of migrating process
+MIGRATION_LOCK_KEY = 20220601
+
+
+def drop_invalid_indexes(connection, statements: list) -> None:
+    """Drop indexes of statements left invalid by interrupted CREATE INDEX CONCURRENTLY, IF NOT EXISTS skips them"""
+    names = [re.search(r"IF NOT EXISTS (\w+)", statement).group(1) for statement in statements]
+    invalid = connection.execute(text("SELECT indexrelid::regclass::text FROM pg_index "
+                                      "WHERE NOT indisvalid AND indexrelid::regclass::text = ANY(:names)"),
+                                 {"names": names}).scalars().all()
+    for name in invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def record_version(connection, version: int, description: str) -> None:
+    connection.execute(text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                       {"version": version, "description": description})
+
+
+def migrate() -> list:
+    """Apply not applied migrations, return applied versions"""
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+        # one migrating process at a time, lock is released with connection
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version "
+                                    "(version integer PRIMARY KEY, description text NOT NULL, "
+                                    "applied_at timestamp with time zone NOT NULL DEFAULT now())"))
+            current = connection.execute(text("SELECT coalesce(max(version), 0) FROM schema_version")).scalar()
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            if version in CONCURRENT_MIGRATIONS:
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                    drop_invalid_indexes(connection, statements)
+                    for statement in statements:
+                        connection.execute(text(statement))
+                    record_version(connection, version, description)
+            else:
+                with engine.begin() as connection:
+                    for statement in statements:
+                        connection.execute(text(statement))
+                    record_version(connection, version, description)
+            applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    metadata.create_all(bind=engine)
+    print(f'applied migrations: {migrate()}')
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, BigInteger, String, Table, DateTime, Date, \
+    UniqueConstraint, Index
 from database import metadata
 
 users = Table(
@@ -8,7 +9,9 @@ users = Table(
     Column("username", String),
     Column("email", String, unique=True, index=True),
     Column("hashed_password", String),
-    Column("is_active", Boolean, default=True)
+    Column("is_active", Boolean, default=True),
+    Column("is_admin", Boolean, nullable=False, default=False),
+    Column("data_version", BigInteger, nullable=False, default=0)
 )
 
 
@@ -19,7 +22,8 @@ investments_items = Table(
     Column("description", String, nullable=False, default='unknown'),
     Column("category_id", Integer, nullable=True),
     Column("owner_id", Integer, ForeignKey("users.id")),
-    Column("is_active", Boolean, default=True)
+    Column("is_active", Boolean, default=True),
+    Index("ix_investments_items_owner_id", "owner_id")
 )
 
 
@@ -27,9 +31,10 @@ investments_history = Table(
     "investments_history",
     metadata,
     Column("id", Integer, unique=True, primary_key=True, autoincrement=True),
-    Column("date", DateTime, nullable=False),
+    Column("date", DateTime(timezone=True), nullable=False),
     Column("sum", Integer, nullable=False),
-    Column("investment_id", Integer, ForeignKey("investments_items.id"))
+    Column("investment_id", Integer, ForeignKey("investments_items.id")),
+    Index("ix_investments_history_investment_id_date", "investment_id", "date", "id", postgresql_include=["sum"])
 )
 
 
@@ -37,10 +42,27 @@ investments_in_out = Table(
     "investments_in_out",
     metadata,
     Column("id", Integer, unique=True, primary_key=True, autoincrement=True),
-    Column("date", DateTime, nullable=False),
+    Column("date", DateTime(timezone=True), nullable=False),
     Column("description", String, nullable=False, default='unknown'),
     Column("sum", Integer, nullable=False, default=0),
-    Column("investment_id", Integer, ForeignKey("investments_items.id"))
+    Column("investment_id", Integer, ForeignKey("investments_items.id")),
+    Index("ix_investments_in_out_investment_id_date", "investment_id", "date", "id")
+)
+
+
+investments_months = Table(
+    "investments_months",
+    metadata,
+    Column("id", Integer, unique=True, primary_key=True, autoincrement=True),
+    Column("investment_id", Integer, ForeignKey("investments_items.id", ondelete="CASCADE"), nullable=False),
+    Column("month", Date, nullable=False),
+    Column("sum_in", BigInteger, nullable=False, default=0),
+    Column("sum_out", BigInteger, nullable=False, default=0),
+    Column("sum_fact", Integer, nullable=True),
+    Column("first_in_id", Integer, nullable=True),
+    Column("first_out_id", Integer, nullable=True),
+    Column("first_fact_id", Integer, nullable=True),
+    UniqueConstraint("investment_id", "month")
 )
 
 
@@ -49,7 +71,8 @@ categories = Table(
     metadata,
     Column("id", Integer, unique=True, primary_key=True, autoincrement=True),
     Column("category", String, nullable=False, default='unknown'),
-    Column("owner_id", Integer, ForeignKey("users.id"))
+    Column("owner_id", Integer, ForeignKey("users.id")),
+    Index("ix_categories_owner_id", "owner_id")
 )
 
 
@@ -57,6 +80,15 @@ key_rate = Table(
     "key_rate",
     metadata,
     Column("id", Integer, unique=True, primary_key=True, autoincrement=True),
-    Column("date", DateTime, nullable=False),
+    Column("date", DateTime(timezone=True), nullable=False),
     Column("key_rate", Integer, nullable=False),
-)
\ No newline at end of file
+)
+
+
+# single row with version of data shared by all users
+global_data_version = Table(
+    "global_data_version",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", BigInteger, nullable=False, default=0),
+)
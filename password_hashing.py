@@ -0,0 +1,66 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE
+from exeptions import PasswordHashingBusy
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt releases GIL, so threads run hashing in parallel without blocking event loop
+executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+
+
+class LatencyStats:
+    """Count, total and max of durations in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def stats(self) -> dict:
+        return {"count": self.count, "avg": self.total / self.count if self.count else 0.0, "max": self.max}
+
+
+password_latency = LatencyStats()
+login_latency = LatencyStats()
+pending = 0
+rejected = 0
+
+
+async def run_password_work(func, *args):
+    """Run hashing in executor, fail fast if workers and queue are full"""
+    global pending, rejected
+    if pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        rejected += 1
+        raise PasswordHashingBusy
+    pending += 1
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        pending -= 1
+        password_latency.observe(time.perf_counter() - start)
+
+
+async def hash_password(password: str) -> str:
+    """Make hashed password from plain"""
+    return await run_password_work(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify user plain password with hashed password"""
+    return await run_password_work(pwd_context.verify, plain_password, hashed_password)
+
+
+def stats() -> dict:
+    return {"pending": pending, "rejected": rejected,
+            "password": password_latency.stats(), "login": login_latency.stats()}
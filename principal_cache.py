@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from config import AUTH_CACHE_TTL, AUTH_CACHE_MAX_ENTRIES
+
+# user row loaded by authentication of current request
+request_user: ContextVar = ContextVar('request_user', default=None)
+
+
+class PrincipalCache:
+    """LRU cache of user rows by username and by id with short time to live"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, user_id: int | None = None, username: str | None = None):
+        """Get user row by id or username, None if not cached or expired"""
+        key = ('id', user_id) if user_id else ('username', username)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user) -> None:
+        """Cache user row by its id and username"""
+        expires = time.monotonic() + self.ttl
+        for key in (('id', user.id), ('username', user.username)):
+            self._entries[key] = (expires, user)
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int | None = None, username: str | None = None) -> None:
+        """Drop user from cache after change of user data"""
+        for key in (('id', user_id), ('username', username)):
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries.pop(('id', entry[1].id), None)
+                self._entries.pop(('username', entry[1].username), None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_MAX_ENTRIES)
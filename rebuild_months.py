@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+
+import asyncio
+
+from database import database, engine, metadata
+
+import crud
+
+
+async def rebuild() -> None:
+    """Rebuild investments_months aggregate table for existing history and in/out"""
+    await database.connect()
+    try:
+        months = await crud.rebuild_investments_months()
+        print(f'investments_months rebuilt: {months} rows')
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    metadata.create_all(bind=engine)
+    asyncio.run(rebuild())
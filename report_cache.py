@@ -0,0 +1,95 @@
+import hashlib
+from collections import OrderedDict
+
+from config import REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_MAX_BYTES
+
+# approximate memory of one "YYYY-MM" series item in report (key, value and dict slot)
+SERIES_ITEM_BYTES = 150
+# approximate memory of one item of list series in columnar report (value and list slot)
+LIST_ITEM_BYTES = 40
+REPORT_ASSET_BYTES = 2000
+
+REPORT_FORMATS = ("v1", "v2")
+
+
+def data_etag(resource: str, version: tuple, params: dict | None = None) -> str:
+    """Strong ETag of resource representation built from data version and query parameters, not from response body
+
+    Version is shared by all processes through DB, so every instance gives the same ETag for the same data.
+    Take version before reading data: changes made while reading give a newer version and a new ETag.
+    """
+    parts = [resource, *(str(item) for item in version)]
+    if params:
+        parts.append(hashlib.blake2s(repr(sorted(params.items())).encode(), digest_size=8).hexdigest())
+    return '"' + "-".join(parts) + '"'
+
+
+def approximate_size(report) -> int:
+    """Approximate memory used by InvestmentReport or InvestmentReportV2"""
+    size = 0
+    for asset in report.investment_report:
+        size += REPORT_ASSET_BYTES
+        for series in asset.__dict__.values():
+            if isinstance(series, dict):
+                size += len(series) * SERIES_ITEM_BYTES
+            elif isinstance(series, list):
+                size += len(series) * LIST_ITEM_BYTES
+    return size
+
+
+class ReportCache:
+    """LRU cache of user reports bounded by entries count and approximate memory
+
+    Entry is valid while data version of user (crud.data_version, kept in DB) is the same as on calculation
+    of report. Every report format of user ("v1" dicts, "v2" columnar) is a separate entry.
+    Every worker process has its own cache, changes made by any process give a new version.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, user_id: int, version: tuple, report_format: str = "v1"):
+        """Get report of user for current data version or None if report not cached or outdated"""
+        entry = self._entries.get((user_id, report_format))
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end((user_id, report_format))
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: int, version: tuple, report, report_format: str = "v1") -> None:
+        """Cache report of user calculated for data version"""
+        self._discard((user_id, report_format))
+        size = approximate_size(report)
+        if size > self.max_bytes:
+            return
+        self._entries[(user_id, report_format)] = (version, report, size)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def discard(self, user_id: int) -> None:
+        """Drop reports of user in all formats"""
+        for report_format in REPORT_FORMATS:
+            self._discard((user_id, report_format))
+
+    def _discard(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "size": self.size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+report_cache = ReportCache(max_entries=REPORT_CACHE_MAX_ENTRIES, max_bytes=REPORT_CACHE_MAX_BYTES)
@@ -0,0 +1,323 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+import schemas
+
+# key rate used for deposit index until first key rate change in asset timeline
+DEFAULT_KEY_RATE = 4
+
+
+def month_index(date) -> int:
+    """Convert date to integer month index (year * 12 + month - 1)"""
+    return date.year * 12 + date.month - 1
+
+
+def month_label(index: int) -> str:
+    """Convert integer month index to "YYYY-MM" report key"""
+    return str(index // 12) + '-' + str(index % 12 + 1).zfill(2)
+
+
+def month_bounds(date: datetime) -> tuple:
+    """First moment of month of date and of next month, aware dates are taken in UTC"""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    month_start = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if month_start.month == 12:
+        return month_start, month_start.replace(year=month_start.year + 1, month=1)
+    return month_start, month_start.replace(month=month_start.month + 1)
+
+
+def round_1(values: np.ndarray) -> np.ndarray:
+    """Round to 1 digit exactly as builtin round() does"""
+    result = np.round(values, 1)
+    scaled = values * 10
+    # np.round differs from builtin round() only when scaling lands on .5
+    for i in np.flatnonzero(scaled - np.floor(scaled) == 0.5):
+        result.flat[i] = round(float(values.flat[i]), 1)
+    return result
+
+
+def series_list(values: np.ndarray, valid: np.ndarray) -> list:
+    """Values as list of python numbers with None where not valid"""
+    if valid.all():
+        return values.tolist()
+    result = values.astype(object)
+    result[~valid] = None
+    return result.tolist()
+
+
+class AssetMonths:
+    """Month buckets of one investment, keys are month indexes in order of first occurrence"""
+
+    def __init__(self):
+        self.sum_in = {}
+        self.sum_out = {}
+        self.sum_fact = {}
+
+    def add_in_out(self, rows) -> None:
+        """Add in/out rows to month buckets"""
+        for row in rows:
+            month = month_index(row['date'])
+            if row['sum'] > 0:
+                self.sum_in[month] = self.sum_in.get(month, 0) + row['sum']
+            elif row['sum'] < 0:
+                self.sum_out[month] = self.sum_out.get(month, 0) + row['sum']
+
+    def add_history(self, rows) -> None:
+        """Add history rows to month buckets, last valuation in month wins"""
+        for row in rows:
+            self.sum_fact[month_index(row['date'])] = row['sum']
+
+    def add_months(self, rows) -> None:
+        """Add rows of investments_months aggregate table in order of first history and in/out rows of months"""
+        sum_in, sum_out, sum_fact = [], [], []
+        for row in rows:
+            month = month_index(row['month'])
+            if row['sum_in'] > 0:
+                sum_in.append((row['first_in_id'] or 0, month, row['sum_in']))
+            if row['sum_out'] < 0:
+                sum_out.append((row['first_out_id'] or 0, month, row['sum_out']))
+            if row['sum_fact'] is not None:
+                sum_fact.append((row['first_fact_id'] or 0, month, row['sum_fact']))
+        for buckets, months in ((self.sum_in, sum_in), (self.sum_out, sum_out), (self.sum_fact, sum_fact)):
+            for _, month, value in sorted(months):
+                buckets[month] = value
+
+    def months(self) -> set:
+        return self.sum_in.keys() | self.sum_out.keys() | self.sum_fact.keys()
+
+
+def key_rates_by_month(list_key_rates) -> dict:
+    """Key rates by month index, last key rate in month wins"""
+    key_rates = {}
+    for key_rate_item in list_key_rates:
+        key_rates[month_index(key_rate_item['date'])] = key_rate_item['key_rate']
+    return key_rates
+
+
+def investments_summary(rows) -> dict:
+    """Last valuation, delta % and plan of every investment in one pass over monthly aggregates
+
+    Rows must be ordered by investment_id and month, delta % is the last one of report (month with non zero plan).
+    """
+    summary = {}
+    for row in rows:
+        item = summary.get(row['investment_id'])
+        if item is None:
+            item = summary[row['investment_id']] = {"sum": 0, "proc": 0, "sum_plan": 0}
+        item['sum_plan'] += row['sum_in'] + row['sum_out']
+        if row['sum_fact'] is not None:
+            item['sum'] = row['sum_fact']
+        if item['sum_plan'] != 0:
+            item['proc'] = round((item['sum'] - item['sum_plan']) / item['sum_plan'] * 100, 1)
+    return summary
+
+
+class KeyRateSeries:
+    """Key rates by month shared by reports of all users
+
+    For every month from first to last key rate change keeps month of last change and key rate in force.
+    """
+
+    def __init__(self, list_key_rates):
+        self.rows = list_key_rates
+        self.by_month = key_rates_by_month(list_key_rates)
+        self.labeled = {month_label(month): rate for month, rate in self.by_month.items()}
+
+        self.first_month = min(self.by_month) if self.by_month else 0
+        months_count = max(self.by_month) - self.first_month + 1 if self.by_month else 0
+        changed = np.zeros(months_count, dtype=bool)
+        rates = np.zeros(months_count)
+        for month, rate in self.by_month.items():
+            changed[month - self.first_month] = True
+            rates[month - self.first_month] = rate
+        last_change = np.maximum.accumulate(np.where(changed, np.arange(months_count), -1))
+        self.change_months = last_change + self.first_month
+        self.rates = rates[last_change]
+
+    def in_force(self, months: np.ndarray) -> tuple:
+        """Month of last key rate change (-1 if none) and key rate in force for every month"""
+        if not len(self.rates):
+            return np.full(len(months), -1), np.full(len(months), float(DEFAULT_KEY_RATE))
+        index = np.minimum(months - self.first_month, len(self.rates) - 1)
+        before_first = index < 0
+        index = np.maximum(index, 0)
+        return (np.where(before_first, -1, self.change_months[index]),
+                np.where(before_first, DEFAULT_KEY_RATE, self.rates[index]))
+
+
+class ReportTimelines:
+    """Report series of all user assets on a shared month axis
+
+    Every series is a matrix (asset, month), months outside of asset [start, end] are not valid.
+    """
+
+    def __init__(self, assets: list, key_rates: KeyRateSeries):
+        self.assets = assets
+        self.key_rates = key_rates
+
+        ranges = [(min(months), max(months)) if months else (0, -1)
+                  for months in (asset.months() for asset in assets)]
+        not_empty = [bounds for bounds in ranges if bounds[1] >= bounds[0]]
+        self.axis_start = min(bounds[0] for bounds in not_empty) if not_empty else 0
+        axis_end = max(bounds[1] for bounds in not_empty) if not_empty else -1
+        self.axis_labels = [month_label(month) for month in range(self.axis_start, axis_end + 1)]
+
+        # asset bounds as column numbers on the month axis
+        self.starts = np.array([bounds[0] - self.axis_start for bounds in ranges], dtype=np.int64)
+        self.ends = np.array([bounds[1] - self.axis_start for bounds in ranges], dtype=np.int64)
+
+        self._compute()
+
+    def _matrix(self, attr: str, dtype) -> tuple:
+        """Dense matrix and presence mask from month buckets"""
+        shape = (len(self.assets), len(self.axis_labels))
+        values = np.zeros(shape, dtype=dtype)
+        present = np.zeros(shape, dtype=bool)
+        rows, columns, data = [], [], []
+        for i, asset in enumerate(self.assets):
+            buckets = getattr(asset, attr)
+            rows.extend([i] * len(buckets))
+            columns.extend(month - self.axis_start for month in buckets)
+            data.extend(buckets.values())
+        if data:
+            values[rows, columns] = data
+            present[rows, columns] = True
+        return values, present
+
+    def _compute(self) -> None:
+        columns = np.arange(len(self.axis_labels), dtype=np.int64)
+        self.in_range = (columns >= self.starts[:, None]) & (columns <= self.ends[:, None])
+
+        self.sum_in, _ = self._matrix('sum_in', np.int64)
+        self.sum_out, _ = self._matrix('sum_out', np.int64)
+        sum_fact, self.has_fact = self._matrix('sum_fact', np.int64)
+        flow = self.sum_in + self.sum_out
+
+        self.sum_plan = np.cumsum(flow, axis=1)
+
+        # forward filled valuation, 0 before first valuation
+        last_fact = np.maximum.accumulate(np.where(self.has_fact, columns, -1), axis=1)
+        self.sum_fact = np.where(last_fact >= 0,
+                                 np.take_along_axis(sum_fact, np.maximum(last_fact, 0), axis=1), 0)
+
+        self.sum_delta_rub = self.sum_fact - self.sum_plan
+
+        items = columns - self.starts[:, None] + 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.sum_cashflow = np.trunc(self.sum_delta_rub / np.maximum(items, 1)).astype(np.int64)
+
+        # delta % and its running average exist only for months with non zero plan
+        self.has_proc = self.in_range & (self.sum_plan != 0)
+        delta_proc = np.zeros(self.sum_plan.shape)
+        delta_proc[self.has_proc] = round_1(self.sum_delta_rub[self.has_proc] / self.sum_plan[self.has_proc] * 100)
+        self.sum_delta_proc = delta_proc
+        proc_items = np.cumsum(self.has_proc, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average = np.cumsum(delta_proc, axis=1) / proc_items
+        self.sum_delta_proc_avg = np.zeros(self.sum_plan.shape)
+        self.sum_delta_proc_avg[self.has_proc] = round_1(average[self.has_proc])
+
+        # key rate in force: last change inside asset timeline or default rate
+        last_change, key_rates = self.key_rates.in_force(columns + self.axis_start)
+        rates = np.where(last_change >= self.starts[:, None] + self.axis_start, key_rates, DEFAULT_KEY_RATE)
+
+        # deposit index d[k] = d[k-1] + in[k] + out[k] plus monthly interest, month by month for all assets,
+        # in the same float operations as the reference implementation, so truncated values are equal
+        deposit_index = np.zeros(self.sum_plan.shape)
+        current = np.zeros(len(self.assets))
+        for column in range(len(self.axis_labels)):
+            current = current + self.sum_in[:, column]
+            current = current + self.sum_out[:, column]
+            current = current + current * (rates[:, column] - 1) / 100 / 12
+            deposit_index[:, column] = current
+        self.sum_deposit_index = np.trunc(deposit_index).astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.trunc(np.where(deposit_index != 0, self.sum_fact / deposit_index * 100 - 100, 0))
+        self.ratio_deposit_index = ratio.astype(np.int64)
+
+    def fill_report_asset(self, asset: schemas.InvestmentReportAsset, i: int) -> None:
+        """Convert series of asset i to "YYYY-MM" dicts of report asset"""
+        months = self.assets[i]
+        # copy of shared key rates, report asset may be changed by caller
+        asset.key_rates = dict(self.key_rates.labeled)
+        asset.sum_in = {month_label(month): value for month, value in months.sum_in.items()}
+        asset.sum_out = {month_label(month): value for month, value in months.sum_out.items()}
+        asset.sum_fact = {month_label(month): value for month, value in months.sum_fact.items()}
+
+        start, end = int(self.starts[i]), int(self.ends[i]) + 1
+        if end <= start:
+            return
+        labels = self.axis_labels[start:end]
+
+        for label, has_fact, value in zip(labels, self.has_fact[i, start:end].tolist(),
+                                          self.sum_fact[i, start:end].tolist()):
+            if not has_fact:
+                asset.sum_fact[label] = value
+
+        asset.sum_plan = dict(zip(labels, self.sum_plan[i, start:end].tolist()))
+        asset.sum_delta_rub = dict(zip(labels, self.sum_delta_rub[i, start:end].tolist()))
+        asset.sum_cashflow = dict(zip(labels, self.sum_cashflow[i, start:end].tolist()))
+        asset.sum_deposit_index = dict(zip(labels, self.sum_deposit_index[i, start:end].tolist()))
+        asset.ratio_deposit_index = dict(zip(labels, self.ratio_deposit_index[i, start:end].tolist()))
+
+        proc_columns = np.flatnonzero(self.has_proc[i])
+        proc_labels = [self.axis_labels[column] for column in proc_columns.tolist()]
+        asset.sum_delta_proc = dict(zip(proc_labels, self.sum_delta_proc[i, proc_columns].tolist()))
+        asset.sum_delta_proc_avg = dict(zip(proc_labels, self.sum_delta_proc_avg[i, proc_columns].tolist()))
+
+    def fill_report_asset_v2(self, asset: schemas.InvestmentReportAssetV2, i: int) -> None:
+        """Copy series of asset i to plain lists from its start on the month axis"""
+        start, end = int(self.starts[i]), int(self.ends[i]) + 1
+        if end <= start:
+            return
+        asset.start = start
+        asset.length = end - start
+
+        sum_in = self.sum_in[i, start:end]
+        sum_out = self.sum_out[i, start:end]
+        has_proc = self.has_proc[i, start:end]
+        asset.sum_in = series_list(sum_in, sum_in > 0)
+        asset.sum_out = series_list(sum_out, sum_out < 0)
+        asset.sum_plan = self.sum_plan[i, start:end].tolist()
+        asset.sum_fact = self.sum_fact[i, start:end].tolist()
+        asset.sum_delta_rub = self.sum_delta_rub[i, start:end].tolist()
+        asset.sum_delta_proc = series_list(self.sum_delta_proc[i, start:end], has_proc)
+        asset.sum_delta_proc_avg = series_list(self.sum_delta_proc_avg[i, start:end], has_proc)
+        asset.sum_cashflow = self.sum_cashflow[i, start:end].tolist()
+        asset.sum_deposit_index = self.sum_deposit_index[i, start:end].tolist()
+        asset.ratio_deposit_index = self.ratio_deposit_index[i, start:end].tolist()
+
+    def tidy_columns(self, investment_ids: list) -> dict:
+        """Long table of report: row per month of every asset, column per series
+
+        Column is (values, valid mask), mask None if all values are valid.
+        """
+        rows, columns = np.nonzero(self.in_range)
+
+        key_rates = np.zeros(len(self.axis_labels))
+        has_key_rate = np.zeros(len(self.axis_labels), dtype=bool)
+        for month, rate in self.key_rates.by_month.items():
+            if 0 <= month - self.axis_start < len(self.axis_labels):
+                key_rates[month - self.axis_start] = rate
+                has_key_rate[month - self.axis_start] = True
+
+        sum_in = self.sum_in[rows, columns]
+        sum_out = self.sum_out[rows, columns]
+        has_proc = self.has_proc[rows, columns]
+        return {
+            "investment_id": (np.asarray(investment_ids, dtype=np.int64)[rows], None),
+            "month": (np.asarray(self.axis_labels, dtype=object)[columns], None),
+            "sum_in": (sum_in, sum_in > 0),
+            "sum_out": (sum_out, sum_out < 0),
+            "sum_plan": (self.sum_plan[rows, columns], None),
+            "sum_fact": (self.sum_fact[rows, columns], None),
+            "sum_delta_rub": (self.sum_delta_rub[rows, columns], None),
+            "sum_delta_proc": (self.sum_delta_proc[rows, columns], has_proc),
+            "sum_delta_proc_avg": (self.sum_delta_proc_avg[rows, columns], has_proc),
+            "sum_cashflow": (self.sum_cashflow[rows, columns], None),
+            "key_rates": (key_rates[columns], has_key_rate[columns]),
+            "sum_deposit_index": (self.sum_deposit_index[rows, columns], None),
+            "ratio_deposit_index": (self.ratio_deposit_index[rows, columns], None),
+        }
@@ -0,0 +1,47 @@
+import csv
+import io
+
+import numpy as np
+import pyarrow as pa
+
+CSV_CHUNK_ROWS = 10000
+ARROW_BATCH_ROWS = 64 * 1024
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "feather": "application/vnd.apache.arrow.file",
+}
+
+
+def _with_nulls(values: np.ndarray, valid) -> list:
+    """Column values as python list, not valid values are None"""
+    if valid is None:
+        return values.tolist()
+    values = values.astype(object)
+    values[~valid] = None
+    return values.tolist()
+
+
+def iterate_csv(columns: dict):
+    """CSV of report long table by chunks of rows, empty field for null"""
+    yield (','.join(columns) + '\n').encode()
+    rows_count = len(next(iter(columns.values()))[0]) if columns else 0
+    for start in range(0, rows_count, CSV_CHUNK_ROWS):
+        chunk = [_with_nulls(values[start:start + CSV_CHUNK_ROWS],
+                             None if valid is None else valid[start:start + CSV_CHUNK_ROWS])
+                 for values, valid in columns.values()]
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(zip(*chunk))
+        yield buffer.getvalue().encode()
+
+
+def arrow_ipc(columns: dict, file_format: bool) -> bytes:
+    """Arrow IPC stream (or Feather v2 file) of report long table"""
+    table = pa.table({name: pa.array(values, mask=None if valid is None else ~valid)
+                      for name, (values, valid) in columns.items()})
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_file(sink, table.schema) if file_format else pa.ipc.new_stream(sink, table.schema)
+    with writer:
+        writer.write_table(table, max_chunksize=ARROW_BATCH_ROWS)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,143 @@
+import codecs
+import csv
+import math
+from datetime import datetime, timezone
+from zipfile import BadZipFile
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from exeptions import ImportFormatError
+
+IMPORT_CHUNK_ROWS = 5000
+
+# titles of exported report columns and of csv columns, other columns are ignored
+IMPORT_TITLES = {'Актив': 'asset',
+                 'Дата': 'date',
+                 'Пополнение': 'sum_in',
+                 'Снятие': 'sum_out',
+                 'Сумма факт': 'sum_fact'}
+
+
+def parse_month(value) -> datetime:
+    """First day of month of report date ("YYYY-MM", "YYYY-MM-DD" or date cell) in UTC"""
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+    try:
+        year, month = str(value).strip().split('-')[:2]
+        return datetime(int(year), int(month), 1, tzinfo=timezone.utc)
+    except ValueError:
+        raise ImportFormatError(f"Wrong date {value!r}")
+
+
+# sums are integer columns in DB
+MAX_SUM = 2 ** 31 - 1
+
+
+def parse_sum(value) -> int | None:
+    """Integer sum of cell, None for empty cell"""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        raise ImportFormatError(f"Wrong sum {value!r}")
+    if not math.isfinite(number) or abs(number) > MAX_SUM:
+        raise ImportFormatError(f"Wrong sum {value!r}")
+    return round(number)
+
+
+def title_columns(titles) -> dict:
+    """Positions of known columns by title row"""
+    columns = {IMPORT_TITLES[title.strip()]: i for i, title in enumerate(titles)
+               if isinstance(title, str) and title.strip() in IMPORT_TITLES}
+    if 'date' not in columns:
+        raise ImportFormatError("Column Дата not found")
+    return columns
+
+
+def parse_row(asset: str, row, columns: dict) -> tuple | None:
+    """(asset, month, sum in, sum out, sum fact) of report row, None for empty row"""
+    def cell(name):
+        i = columns.get(name)
+        return row[i] if i is not None and i < len(row) else None
+
+    if cell('date') in (None, ''):
+        return None
+    sum_out = parse_sum(cell('sum_out'))
+    return (asset, parse_month(cell('date')), parse_sum(cell('sum_in')),
+            None if sum_out is None else -abs(sum_out), parse_sum(cell('sum_fact')))
+
+
+def iterate_xlsx(file):
+    """Rows of xlsx report, one sheet per asset, read in streaming mode"""
+    try:
+        wb = load_workbook(file, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile, KeyError):
+        raise ImportFormatError("File is not xlsx")
+    try:
+        for sht in wb.worksheets:
+            rows = sht.iter_rows(values_only=True)
+            titles = next(rows, None)
+            if titles is None:
+                continue
+            columns = title_columns(titles)
+            for row in rows:
+                parsed = parse_row(sht.title, row, columns)
+                if parsed:
+                    yield parsed
+    finally:
+        wb.close()
+
+
+def iterate_csv(file):
+    """Rows of csv with Актив column and columns of xlsx report"""
+    reader = csv.reader(codecs.getreader('utf-8-sig')(file))
+    columns = title_columns(next(reader, []))
+    if 'asset' not in columns:
+        raise ImportFormatError("Column Актив not found")
+    for row in reader:
+        parsed = parse_row(row[columns['asset']].strip() if columns['asset'] < len(row) else '', row, columns)
+        if parsed:
+            if not parsed[0]:
+                raise ImportFormatError("Empty Актив")
+            yield parsed
+
+
+def actual_facts(rows):
+    """Rows with sum fact only where it was entered
+
+    Report repeats last sum fact in every next month and has 0 before first one,
+    so sum fact equal to previous one of asset (0 at start) is dropped.
+    """
+    last_fact = {}
+    for asset, date, sum_in, sum_out, sum_fact in rows:
+        if sum_fact is not None:
+            if sum_fact == last_fact.get(asset, 0):
+                sum_fact = None
+            else:
+                last_fact[asset] = sum_fact
+        yield asset, date, sum_in, sum_out, sum_fact
+
+
+def iterate_rows(file, file_format: str):
+    """Parsed rows of uploaded xlsx or csv file"""
+    try:
+        if file_format == 'xlsx':
+            yield from actual_facts(iterate_xlsx(file))
+        else:
+            yield from actual_facts(iterate_csv(file))
+    except (UnicodeDecodeError, csv.Error):
+        raise ImportFormatError("File is not utf-8 csv")
+
+
+def iterate_chunks(file, file_format: str):
+    """Parsed rows of uploaded file by lists of IMPORT_CHUNK_ROWS rows"""
+    chunk = []
+    for row in iterate_rows(file, file_format):
+        chunk.append(row)
+        if len(chunk) == IMPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
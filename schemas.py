@@ -1,8 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Union, Dict
 from pydantic import BaseModel, BaseSettings, Field
 
 
+def utc_now() -> datetime:
+    """Current UTC-aware datetime, dates are stored as timestamptz"""
+    return datetime.now(timezone.utc)
+
+
 class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -15,6 +20,32 @@ class Settings(BaseSettings):
     EXCEPTION_PER_SEC_LIMIT: int
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    REPORT_ENGINE: str = 'numpy'
+    REPORT_CACHE_MAX_ENTRIES: int = 256
+    REPORT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    AUTH_CACHE_TTL: float = 30
+    AUTH_CACHE_MAX_ENTRIES: int = 1024
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_QUEUE: int = 32
+    FAILURE_LIMIT_BURST: int = 5
+    FAILURE_LIMIT_MAX_KEYS: int = 100000
+    TRUSTED_PROXIES: str = '127.0.0.1'
+    XLSX_SPOOL_MAX_SIZE: int = 8 * 1024 * 1024
+    BATCH_MAX_ITEMS: int = 10000
+    DB_POOL_MIN_SIZE: int = 10
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_ACQUIRE_TIMEOUT: float = 10
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_CONNECTION_MAX_LIFETIME: float = 300
+    DB_CONNECTION_MAX_QUERIES: int = 50000
+    DB_POOL_READY_MAX_WAITERS: int = 10
+    SQL_TRACE: bool = False
+    SQL_TRACE_REPEAT_THRESHOLD: int = 5
+    SQL_TRACE_SLOW_REQUEST: float = 1
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_THREADPOOL_MIN_SIZE: int = 64 * 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
 
     class Config:
         env_file = ".env"
@@ -38,6 +69,7 @@ class UserInDB(UserBase):
     id: int
     hashed_password: str
     is_active: bool
+    is_admin: bool = False
 
     class Config:
         orm_mode = True
@@ -85,6 +117,7 @@ class InvestmentOut(BaseModel):
     is_active: bool = True
     sum: int
     proc: float
+    sum_plan: int = 0
 
     class Config:
         orm_mode = True
@@ -144,7 +177,7 @@ class CategoryUser(BaseModel):
 
 
 class HistoryBase(BaseModel):
-    date: datetime = Field(default_factory=datetime.now)
+    date: datetime = Field(default_factory=utc_now)
     sum: int = 0
     investment_id: int
 
@@ -180,13 +213,14 @@ class HistoryDelete(BaseModel):
 
 class HistoryUser(BaseModel):
     history: List[HistoryOut] = []
+    next_cursor: Union[None, str] = None
 
     class Config:
         orm_mode = True
 
 
 class InOutBase(BaseModel):
-    date: datetime = Field(default_factory=datetime.now)
+    date: datetime = Field(default_factory=utc_now)
     description: str = 'Прочие корректировки'
     sum: int = 0
     investment_id: int
@@ -224,13 +258,14 @@ class InOutDelete(BaseModel):
 
 class InOutUser(BaseModel):
     in_out: List[InOutOut] = []
+    next_cursor: Union[None, str] = None
 
     class Config:
         orm_mode = True
 
 
 class KeyRateBase(BaseModel):
-    date: datetime = Field(default_factory=datetime.now)
+    date: datetime = Field(default_factory=utc_now)
     key_rate: int = 0
 
 
@@ -273,6 +308,26 @@ class Result(BaseModel):
     result: str
 
 
+class BatchItemResult(BaseModel):
+    index: int
+    id: Union[None, int] = None
+    error: Union[None, str] = None
+
+
+class BatchResult(BaseModel):
+    processed: int = 0
+    items: List[BatchItemResult] = []
+
+
+class ImportResult(BaseModel):
+    rows: int = 0
+    investments: int = 0
+    history: int = 0
+    in_out: int = 0
+    skipped: int = 0
+    done: bool = False
+
+
 class InvestmentReportAsset(BaseModel):
     sum_in: Dict[str, int] = {}
     sum_out: Dict[str, int] = {}
@@ -292,4 +347,32 @@ class InvestmentReportAsset(BaseModel):
 
 
 class InvestmentReport(BaseModel):
-    investment_report: List[InvestmentReportAsset] = []
\ No newline at end of file
+    investment_report: List[InvestmentReportAsset] = []
+
+
+class InvestmentReportAssetV2(BaseModel):
+    """Series of asset from its start on month axis of report, None in months without value"""
+    description: str = ""
+    category: str = ""
+    id: int = 0
+    category_id: Union[None, int] = None
+    start: int = 0
+    length: int = 0
+    sum_in: List[Union[None, int]] = []
+    sum_out: List[Union[None, int]] = []
+    sum_plan: List[int] = []
+    sum_fact: List[int] = []
+    sum_delta_rub: List[int] = []
+    sum_delta_proc: List[Union[None, float]] = []
+    sum_delta_proc_avg: List[Union[None, float]] = []
+    sum_cashflow: List[int] = []
+    sum_deposit_index: List[int] = []
+    ratio_deposit_index: List[int] = []
+
+
+class InvestmentReportV2(BaseModel):
+    """Columnar report: month axis from start_month shared by assets, key rates once for all assets"""
+    start_month: str = ""
+    months: int = 0
+    key_rates: Dict[str, int] = {}
+    investment_report: List[InvestmentReportAssetV2] = []
\ No newline at end of file
@@ -0,0 +1,145 @@
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy.sql import ClauseElement
+
+import metrics
+from config import SQL_TRACE_REPEAT_THRESHOLD, SQL_TRACE_SLOW_REQUEST
+
+logger = logging.getLogger("sql_trace")
+
+# trace of queries of current request or test, None if tracing is off
+current_trace: ContextVar = ContextVar('current_trace', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Traced code ran more queries than allowed"""
+
+
+def _shape(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+class QueryTrace:
+    """Statements run while trace is current: template, shape of parameters, rows and duration"""
+
+    def __init__(self):
+        self.statements = []
+        self.started = time.perf_counter()
+
+    def add(self, method: str, query, values, result, seconds: float) -> None:
+        if isinstance(query, ClauseElement):
+            compiled = query.compile()
+            template, params = str(compiled), compiled.params
+        else:
+            template, params = str(query), values or {}
+        if method == "execute_many":
+            params, rows = (values[0] if values else {}), len(values or [])
+        elif method == "fetch_all":
+            rows = len(result or [])
+        elif method in ("fetch_one", "fetch_val"):
+            rows = int(result is not None)
+        else:
+            rows = None
+        self.statements.append({"method": method, "template": " ".join(template.split()),
+                                "params": {name: _shape(value) for name, value in params.items()},
+                                "rows": rows, "seconds": seconds})
+
+    @property
+    def db_seconds(self) -> float:
+        return sum(statement["seconds"] for statement in self.statements)
+
+    def repeated(self, threshold: int = SQL_TRACE_REPEAT_THRESHOLD) -> dict:
+        """Templates run at least threshold times (N+1 candidates) with their counts"""
+        counts = {}
+        for statement in self.statements:
+            counts[statement["template"]] = counts.get(statement["template"], 0) + 1
+        return {template: count for template, count in counts.items() if count >= threshold}
+
+    def summary(self, top: int = 5) -> dict:
+        """Queries, DB time and slowest templates by total time"""
+        templates = {}
+        for statement in self.statements:
+            item = templates.setdefault(statement["template"], {"template": statement["template"],
+                                                                "count": 0, "seconds": 0.0, "rows": 0})
+            item["count"] += 1
+            item["seconds"] += statement["seconds"]
+            item["rows"] += statement["rows"] or 0
+        return {"queries": len(self.statements), "db_seconds": self.db_seconds,
+                "slowest": sorted(templates.values(), key=lambda item: -item["seconds"])[:top]}
+
+    def assert_budget(self, max_queries: int | None = None, max_repeats: int | None = None) -> None:
+        """Fail if more than max_queries statements or same template more than max_repeats times"""
+        if max_queries is not None and len(self.statements) > max_queries:
+            raise QueryBudgetExceeded(f"{len(self.statements)} queries, budget {max_queries}: "
+                                      f"{[statement['template'] for statement in self.statements]}")
+        if max_repeats is not None:
+            repeated = self.repeated(max_repeats + 1)
+            if repeated:
+                raise QueryBudgetExceeded(f"statements repeated more than {max_repeats} times: {repeated}")
+
+
+@contextmanager
+def trace():
+    """Trace queries of enclosed code, usable in tests: with trace() as queries: ..."""
+    query_trace = QueryTrace()
+    token = current_trace.set(query_trace)
+    try:
+        yield query_trace
+    finally:
+        current_trace.reset(token)
+
+
+def _observed(name: str, method):
+    @functools.wraps(method)
+    async def observed(query, values=None, *args, **kwargs):
+        start = time.perf_counter()
+        result = await method(query, values, *args, **kwargs)
+        query_trace = current_trace.get()
+        if query_trace is not None:
+            query_trace.add(name, query, values, result, time.perf_counter() - start)
+        return result
+    observed.traced_query = True
+    return observed
+
+
+def observe_queries(database) -> None:
+    """Record queries of database in current trace"""
+    for name in metrics.QUERY_METHODS:
+        method = getattr(database, name)
+        if not getattr(method, "traced_query", False):
+            setattr(database, name, _observed(name, method))
+
+
+class SqlTraceMiddleware:
+    """ASGI middleware tracing queries of every request, logs N+1 patterns and slow requests as json"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with trace() as query_trace:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.log(scope, query_trace, time.perf_counter() - query_trace.started)
+
+    @staticmethod
+    def log(scope, query_trace: QueryTrace, seconds: float) -> None:
+        request = {"method": scope["method"], "route": metrics.route_template(scope), "seconds": seconds}
+        repeated = query_trace.repeated()
+        if repeated:
+            logger.warning(json.dumps({"event": "repeated_queries", **request, "repeated": repeated},
+                                      ensure_ascii=False))
+        if seconds >= SQL_TRACE_SLOW_REQUEST:
+            logger.warning(json.dumps({"event": "slow_request", **request, **query_trace.summary()},
+                                      ensure_ascii=False))
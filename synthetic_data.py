@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import random
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from database import database, engine, metadata
+from models import users, investments_items, investments_history, investments_in_out, key_rate
+
+import crud
+import report_engine
+
+
+def month_date(index: int, day: int = 1) -> datetime:
+    """Date in month of month index"""
+    return datetime(index // 12, index % 12 + 1, day, 12, tzinfo=timezone.utc)
+
+
+def generate_dataset(investments: int, years: int, seed: int = 0, last_month: int | None = None) -> dict:
+    """Investments with monthly valuations, in/out flows and key rate changes of one user
+
+    Every investment starts in a random month of the period with a deposit, is topped up or partly
+    withdrawn now and then and is valued every month by a random walk with a small positive drift.
+    Rows refer to investments by position in list of investments.
+    """
+    rnd = random.Random(seed)
+    if last_month is None:
+        last_month = report_engine.month_index(datetime.now(timezone.utc)) - 1
+    first_month = last_month - years * 12 + 1
+    dataset = {"investments": [], "history": [], "in_out": [], "key_rates": []}
+
+    for i in range(investments):
+        dataset["investments"].append({"description": f"Инвестиция {i + 1}", "category_id": None, "is_active": True})
+        start = rnd.randint(first_month, last_month)
+        value = plan = rnd.randint(10, 1000) * 1000
+        dataset["in_out"].append({"investment": i, "date": month_date(start, rnd.randint(1, 28)),
+                                  "description": "Пополнение", "sum": plan})
+        for month in range(start, last_month + 1):
+            flow = 0
+            if month > start and rnd.random() < 0.3:
+                flow = rnd.randint(1, 100) * 1000
+            elif month > start and rnd.random() < 0.05:
+                flow = -min(value // 2, rnd.randint(1, 100) * 1000)
+            if flow:
+                dataset["in_out"].append({"investment": i, "date": month_date(month, rnd.randint(1, 28)),
+                                          "description": "Пополнение" if flow > 0 else "Снятие", "sum": flow})
+            value = max(0, int(value * (1 + rnd.gauss(0.007, 0.03))) + flow)
+            dataset["history"].append({"investment": i, "date": month_date(month, 28), "sum": value})
+
+    rate = rnd.randint(4, 12)
+    for month in range(first_month, last_month + 1, 6):
+        rate = min(20, max(4, rate + rnd.randint(-2, 2)))
+        dataset["key_rates"].append({"date": month_date(month), "key_rate": rate})
+    return dataset
+
+
+async def create_user_dataset(dataset: dict, username: str) -> int:
+    """Save dataset as new user in DB, key rates are added only to empty key rate table"""
+    async with database.transaction():
+        user_id = await database.execute(users.insert().values(username=username, email=f"{username}@example.com",
+                                                               hashed_password="", is_active=True))
+        rows = await database.fetch_all(investments_items.insert()
+                                        .values([{**investment, "owner_id": user_id}
+                                                 for investment in dataset["investments"]])
+                                        .returning(investments_items.c.id))
+        ids = [row["id"] for row in rows]
+        history = [{"date": row["date"], "sum": row["sum"], "investment_id": ids[row["investment"]]}
+                   for row in dataset["history"]]
+        in_out = [{"date": row["date"], "description": row["description"], "sum": row["sum"],
+                   "investment_id": ids[row["investment"]]} for row in dataset["in_out"]]
+        await crud.insert_rows(investments_history, history)
+        await crud.insert_rows(investments_in_out, in_out)
+        if not await database.fetch_val(select(func.count()).select_from(key_rate)):
+            await crud.insert_rows(key_rate, dataset["key_rates"])
+            await crud.bump_global_version()
+        await crud.refresh_investments_months({(row["investment_id"], crud.month_of(row["date"]))
+                                               for row in history + in_out})
+    return user_id
+
+
+async def main(investments: int, years: int, seed: int, username: str) -> None:
+    await database.connect()
+    try:
+        user_id = await create_user_dataset(generate_dataset(investments, years, seed), username)
+        print(f'user {username} created: id {user_id}')
+    finally:
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create user with synthetic investments in DB")
+    parser.add_argument("--investments", type=int, default=50)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--username", default="synthetic")
+    args = parser.parse_args()
+    metadata.create_all(bind=engine)
+    asyncio.run(main(args.investments, args.years, args.seed, args.username))
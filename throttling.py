@@ -0,0 +1,96 @@
+import math
+import time
+from contextvars import ContextVar
+
+from config import EXCEPTION_PER_SEC_LIMIT, FAILURE_LIMIT_BURST, FAILURE_LIMIT_MAX_KEYS, TRUSTED_PROXIES
+
+# ip address of client of current request
+client_ip: ContextVar = ContextVar('client_ip', default=None)
+
+EVICTION_INTERVAL = 60
+
+
+def forwarded_client(peer: str, headers: list, trusted_proxies=TRUSTED_PROXIES) -> str:
+    """Client address: peer, or last untrusted address of X-Forwarded-For if peer is trusted proxy"""
+    if peer not in trusted_proxies:
+        return peer
+    forwarded = [value.decode("latin-1") for name, value in headers if name == b"x-forwarded-for"]
+    addresses = [address.strip() for value in forwarded for address in value.split(",")]
+    for address in reversed(addresses):
+        if address and address not in trusted_proxies:
+            return address
+    return peer
+
+
+class ClientIpMiddleware:
+    """ASGI middleware saving client ip address of request to client_ip"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("client"):
+            client_ip.set(forwarded_client(scope["client"][0], scope["headers"]))
+        await self.app(scope, receive, send)
+
+
+class FailureLimiter:
+    """Token bucket of allowed failures per key (ip address, username)
+
+    Every key may fail burst times in a row, then once per interval seconds.
+    Bucket of key is [tokens, time of update], full buckets are evicted periodically.
+    """
+
+    def __init__(self, interval: float, burst: int, max_keys: int):
+        self.interval = interval
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = {}
+        self._next_eviction = time.monotonic() + EVICTION_INTERVAL
+
+    def _tokens(self, bucket: list, now: float) -> float:
+        if self.interval <= 0:
+            return self.burst
+        return min(self.burst, bucket[0] + (now - bucket[1]) / self.interval)
+
+    def retry_after(self, *keys) -> int:
+        """Seconds to wait before next attempt for keys, 0 if attempt allowed"""
+        now = time.monotonic()
+        wait = 0.0
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None and self._tokens(bucket, now) < 1:
+                wait = max(wait, (1 - self._tokens(bucket, now)) * self.interval)
+        if wait:
+            self.rejected += 1
+        return math.ceil(wait)
+
+    def failure(self, *keys) -> None:
+        """Spend one token of every key for failed attempt"""
+        now = time.monotonic()
+        for key in keys:
+            bucket = self._buckets.get(key)
+            tokens = self.burst if bucket is None else self._tokens(bucket, now)
+            # reinsert to keep keys ordered by last failure
+            self._buckets.pop(key, None)
+            self._buckets[key] = [max(tokens - 1, 0), now]
+        if now >= self._next_eviction or len(self._buckets) > self.max_keys:
+            self.evict(now)
+
+    def evict(self, now: float) -> None:
+        """Drop keys with full buckets, drop oldest keys if still too many"""
+        self._next_eviction = now + EVICTION_INTERVAL
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if self._tokens(bucket, now) < self.burst}
+        if len(self._buckets) > self.max_keys:
+            # keep room for new keys to not sweep on every failure
+            keys = list(self._buckets)[len(self._buckets) - self.max_keys * 9 // 10:]
+            self._buckets = {key: self._buckets[key] for key in keys}
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "rejected": self.rejected}
+
+
+failure_limiter = FailureLimiter(interval=EXCEPTION_PER_SEC_LIMIT, burst=FAILURE_LIMIT_BURST,
+                                 max_keys=FAILURE_LIMIT_MAX_KEYS)